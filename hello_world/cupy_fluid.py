@@ -1,6 +1,28 @@
-import cupy as cp
+import os
+import argparse
+import tracemalloc
+from collections import deque
 import numpy as np
-import matplotlib.pyplot as plt
+
+# CuPy is optional: without it (or without a usable GPU) the solver runs on NumPy.
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+# Numba compiles the fused CPU kernels; without it they run as plain NumPy.
+try:
+    import numba
+    from numba import prange
+except ImportError:
+    numba = None
+    prange = range
+
+# Plotting is only needed for the interactive display.
+try:
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
 
 # Grid parameters
 N = 128         # Grid size (N x N cells)
@@ -8,119 +30,646 @@ dt = 0.1        # Time step
 diff = 0.0001   # Diffusion rate
 visc = 0.0001   # Viscosity
 iter = 20       # Number of iterations for the linear solver
+solver = os.environ.get('FLUID_SOLVER', 'jacobi')  # Linear solver: 'jacobi', 'fused' or 'rbgs'
+pressure_solver = os.environ.get('FLUID_PRESSURE', 'fixed')  # Pressure solve: 'fixed', 'multigrid' or 'pcg'
+pressure_tol = float(os.environ.get('FLUID_PRESSURE_TOL', 1e-4))  # Relative residual to stop at
+pressure_max_iter = 100  # Cap on V-cycles / CG iterations per pressure solve
 
 # Helper: convert 2D indices to a single index (if needed)
 def IX(i, j):
     return i + (N + 2) * j
 
-# Allocate fields on the GPU (include 1-cell boundary padding)
-shape = (N + 2, N + 2)
-u     = cp.zeros(shape, dtype=cp.float32)  # velocity x-component
-v     = cp.zeros(shape, dtype=cp.float32)  # velocity y-component
-u_prev = cp.zeros(shape, dtype=cp.float32)
-v_prev = cp.zeros(shape, dtype=cp.float32)
-dens  = cp.zeros(shape, dtype=cp.float32)
-dens_prev = cp.zeros(shape, dtype=cp.float32)
+def select_backend(name='auto'):
+    # 'numpy', 'cupy', or 'auto' (CuPy when it is installed and sees a GPU).
+    if name == 'numpy':
+        return np
+    if cp is None:
+        if name == 'cupy':
+            raise RuntimeError("The cupy backend was requested but CuPy is not installed.")
+        return np
+    if name == 'auto':
+        try:
+            if cp.cuda.runtime.getDeviceCount() == 0:
+                return np
+        except Exception:
+            return np
+    return cp
+
+def array_module(x):
+    # The module (NumPy or CuPy) that owns x, so the solver follows its inputs.
+    return cp.get_array_module(x) if cp is not None else np
+
+def to_numpy(x):
+    return cp.asnumpy(x) if array_module(x) is not np else x
+
+# Preallocated work arrays keyed by (module, name, shape, dtype). Contiguous
+# scratch keeps stencil temporaries cache-friendly and off the allocator.
+_scratch = {}
+
+def scratch(xp, name, shape, dtype, zero=False):
+    # zero=True starts the buffer at zero, for callers that only ever write its interior.
+    key = (xp.__name__, name, shape, xp.dtype(dtype).str)
+    buf = _scratch.get(key)
+    if buf is None:
+        buf = _scratch[key] = (xp.zeros if zero else xp.empty)(shape, dtype=dtype)
+    return buf
+
+def init_fields(backend=None, n=None):
+    # Select the array backend and (re)allocate every field (with 1-cell boundary padding) on it.
+    global xp, N, shape, u, v, u_prev, v_prev, dens, dens_prev
+    xp = select_backend(backend or os.environ.get('FLUID_BACKEND', 'auto'))
+    N = n or N
+    shape = (N + 2, N + 2)
+    u     = xp.zeros(shape, dtype=xp.float32)  # velocity x-component
+    v     = xp.zeros(shape, dtype=xp.float32)  # velocity y-component
+    u_prev = xp.zeros(shape, dtype=xp.float32)
+    v_prev = xp.zeros(shape, dtype=xp.float32)
+    dens  = xp.zeros(shape, dtype=xp.float32)
+    dens_prev = xp.zeros(shape, dtype=xp.float32)
+
+init_fields()
 
 def add_source(x, s):
-    x += dt * s
+    xp = array_module(x)
+    t = scratch(xp, 'add_source', x.shape, x.dtype)
+    xp.multiply(s, dt, out=t)
+    x += t
+
+if cp is not None:
+    corner_kernel = cp.ElementwiseKernel(
+        'raw T x, int32 w', '',
+        '''
+        int r = (i / 2) * (w - 1), q = (i % 2) * (w - 1);
+        x[r * w + q] = (T)0.5 * (x[(r ? r - 1 : 1) * w + q] + x[r * w + (q ? q - 1 : 1)]);
+        ''',
+        'set_corners')
+
+def mirror(xp, src, dst, negate):
+    if negate:
+        xp.negative(src, out=dst)
+    else:
+        dst[...] = src
 
 def set_bnd(b, x):
+    xp = array_module(x)
     # Simple boundary conditions: reflect velocity at boundaries, zero-gradient for scalars.
     # b = 1 for horizontal velocity; b = 2 for vertical velocity.
     # For indices 0 and N+1, mirror the values.
-    x[0, 1:-1]   = cp.where(b == 1, -x[1, 1:-1], x[1, 1:-1])
-    x[-1, 1:-1]  = cp.where(b == 1, -x[-2, 1:-1], x[-2, 1:-1])
-    x[1:-1, 0]   = cp.where(b == 2, -x[1:-1, 1], x[1:-1, 1])
-    x[1:-1, -1]  = cp.where(b == 2, -x[1:-1, -2], x[1:-1, -2])
+    # Edges are written in place so no temporaries are allocated.
+    mirror(xp, x[1, 1:-1], x[0, 1:-1], b == 1)
+    mirror(xp, x[-2, 1:-1], x[-1, 1:-1], b == 1)
+    mirror(xp, x[1:-1, 1], x[1:-1, 0], b == 2)
+    mirror(xp, x[1:-1, -2], x[1:-1, -1], b == 2)
     # Corners:
+    if xp is not np:
+        # Element assignments would allocate 0-d device temporaries; one launch writes all four.
+        corner_kernel(x, x.shape[0], size=4)
+        return
     x[0, 0]      = 0.5 * (x[1,0] + x[0,1])
     x[0, -1]     = 0.5 * (x[1,-1] + x[0,-2])
     x[-1, 0]     = 0.5 * (x[-2,0] + x[-1,1])
     x[-1, -1]    = 0.5 * (x[-2,-1] + x[-1,-2])
 
-def lin_solve(b, x, x0, a, c):
+def jacobi(b, x, x0, a, c):
+    # Jacobi sweeps. The stencil is evaluated in place in one contiguous scratch
+    # array, in the same operation order as (x0 + a * (sum of neighbours)) / c.
+    xp = array_module(x)
+    acc = scratch(xp, 'lin_solve', (x.shape[0] - 2, x.shape[1] - 2), x.dtype)
+    for k in range(iter):
+        xp.add(x[0:-2, 1:-1], x[2:, 1:-1], out=acc)
+        acc += x[1:-1, 0:-2]
+        acc += x[1:-1, 2:  ]
+        acc *= a
+        acc += x0[1:-1, 1:-1]
+        acc /= c
+        x[1:-1, 1:-1] = acc
+        set_bnd(b, x)
+
+# Fused kernels: one launch per sweep computes the stencil for every cell and
+# writes the boundary cells from the same values, so no set_bnd pass is needed.
+# A boundary cell evaluates the stencil of its nearest interior cell and mirrors
+# it; corners average their two mirrored neighbours exactly as set_bnd does.
+if cp is not None:
+    fused_jacobi_kernel = cp.ElementwiseKernel(
+        'raw T x, raw T x0, T a, T c, int32 n, int32 b', 'T y',
+        '''
+        int w = n + 2;
+        int r = i / w, q = i % w;
+        int k = min(max(r, 1), n) * w + min(max(q, 1), n);
+        T s = (x0[k] + a * (x[k - w] + x[k + w] + x[k - 1] + x[k + 1])) / c;
+        T sr = (b == 1) ? -s : s;
+        T sc = (b == 2) ? -s : s;
+        bool er = (r == 0 || r == n + 1), ec = (q == 0 || q == n + 1);
+        y = (er && ec) ? (T)0.5 * (sr + sc) : (er ? sr : (ec ? sc : s));
+        ''',
+        'fused_jacobi')
+
+    # Updates the cells of one colour in place; the other colour is only read.
+    red_black_kernel = cp.ElementwiseKernel(
+        'raw T x, raw T x0, T a, T c, int32 n, int32 parity', '',
+        '''
+        int w = n + 2;
+        int r = i / n + 1, q = i % n + 1;
+        if (((r + q) & 1) == parity) {
+            int k = r * w + q;
+            x[k] = (x0[k] + a * (x[k - w] + x[k + w] + x[k - 1] + x[k + 1])) / c;
+        }
+        ''',
+        'red_black_gs')
+
+def fused_jacobi_cpu(x, y, x0, a, c, b):
+    n = x.shape[0] - 2
+    for r in prange(1, n + 1):
+        for q in range(1, n + 1):
+            y[r, q] = (x0[r, q] + a * (x[r-1, q] + x[r+1, q] + x[r, q-1] + x[r, q+1])) / c
+    for k in range(1, n + 1):
+        y[0, k] = -y[1, k] if b == 1 else y[1, k]
+        y[n+1, k] = -y[n, k] if b == 1 else y[n, k]
+        y[k, 0] = -y[k, 1] if b == 2 else y[k, 1]
+        y[k, n+1] = -y[k, n] if b == 2 else y[k, n]
+    y[0, 0] = 0.5 * (y[1, 0] + y[0, 1])
+    y[0, n+1] = 0.5 * (y[1, n+1] + y[0, n])
+    y[n+1, 0] = 0.5 * (y[n, 0] + y[n+1, 1])
+    y[n+1, n+1] = 0.5 * (y[n, n+1] + y[n+1, n])
+
+def red_black_cpu(x, x0, a, c, parity):
+    n = x.shape[0] - 2
+    for r in prange(1, n + 1):
+        for q in range(1 + (r + 1 + parity) % 2, n + 1, 2):
+            x[r, q] = (x0[r, q] + a * (x[r-1, q] + x[r+1, q] + x[r, q-1] + x[r, q+1])) / c
+
+if numba is not None:
+    fused_jacobi_cpu = numba.njit(parallel=True)(fused_jacobi_cpu)
+    red_black_cpu = numba.njit(parallel=True)(red_black_cpu)
+
+def fused_jacobi(b, x, x0, a, c):
+    # Jacobi sweeps that ping-pong between x and one preallocated buffer,
+    # with the boundary conditions applied inside each sweep.
+    xp = array_module(x)
+    if xp is np and numba is None:
+        # Interpreted loops would be far slower than the sliced sweep.
+        return jacobi(b, x, x0, a, c)
+    a, c = x.dtype.type(a), x.dtype.type(c)
+    src, dst = x, scratch(xp, 'fused_jacobi', x.shape, x.dtype)
+    for k in range(iter):
+        if xp is np:
+            fused_jacobi_cpu(src, dst, x0, a, c, b)
+        else:
+            fused_jacobi_kernel(src, x0, a, c, x.shape[0] - 2, b, dst)
+        src, dst = dst, src
+    if src is not x:
+        x[...] = src
+
+def red_black(b, x, x0, a, c):
+    # Red-black Gauss-Seidel: each colour is updated from the freshest values of
+    # the other, which roughly halves the sweeps needed for the same residual.
+    a, c = x.dtype.type(a), x.dtype.type(c)
     for k in range(iter):
-        x[1:-1, 1:-1] = (x0[1:-1, 1:-1] + a * (x[0:-2, 1:-1] +
-                                                   x[2:  , 1:-1] +
-                                                   x[1:-1, 0:-2] +
-                                                   x[1:-1, 2:  ])) / c
+        red_black_sweep(x, x0, a, c, 0)
+        red_black_sweep(x, x0, a, c, 1)
         set_bnd(b, x)
 
+def red_black_sweep(x, x0, a, c, parity):
+    # Update the cells of one colour (parity 0 = red, 1 = black) on the fastest available path.
+    n = x.shape[0] - 2
+    if array_module(x) is not np:
+        red_black_kernel(x, x0, a, c, n, parity, size=n * n)
+    elif numba is not None:
+        red_black_cpu(x, x0, a, c, parity)
+    else:
+        red_black_numpy(x, x0, a, c, parity)
+
+def red_black_numpy(x, x0, a, c, parity):
+    # Each colour is two strided sub-lattices, (1, 1)/(2, 2) for red and (1, 2)/(2, 1) for black.
+    n = x.shape[0] - 2
+    for r0, q0 in (((1, 1), (2, 2)), ((1, 2), (2, 1)))[parity]:
+        rows, cols = slice(r0, n + 1, 2), slice(q0, n + 1, 2)
+        cell = x[rows, cols]
+        acc = scratch(np, 'red_black', cell.shape, x.dtype)
+        np.add(x[r0-1:n:2, cols], x[r0+1:n+2:2, cols], out=acc)
+        acc += x[rows, q0-1:n:2]
+        acc += x[rows, q0+1:n+2:2]
+        acc *= a
+        acc += x0[rows, cols]
+        acc /= c
+        cell[...] = acc
+
+LIN_SOLVERS = {'jacobi': jacobi, 'fused': fused_jacobi, 'rbgs': red_black}
+
+def lin_solve(b, x, x0, a, c):
+    LIN_SOLVERS[solver](b, x, x0, a, c)
+
 def diffuse(b, x, x0, diff_coef):
     a = dt * diff_coef * N * N
     lin_solve(b, x, x0, a, 1 + 4 * a)
 
+# Semi-Lagrangian advection. Every path traces back from the cell centre, clamps
+# to [0.5, N + 0.5] and samples bilinearly in float64, as the original array
+# expression did, then stores in the field's dtype. Several fields moved by the
+# same velocity share one backtrace and one set of weights.
+if cp is not None:
+    # Up to three fields per launch; unused slots repeat the first one and are skipped.
+    advect_kernel = cp.ElementwiseKernel(
+        'raw T u, raw T v, raw T a0, raw T b0, raw T c0, raw T a, raw T b, raw T c, '
+        'T dt0, int32 n, int32 count', '',
+        '''
+        int w = n + 2;
+        int k = (i / n + 1) * w + i % n + 1;
+        double x = min(max((double)(i % n + 1) - (double)(dt0 * u[k]), 0.5), n + 0.5);
+        double y = min(max((double)(i / n + 1) - (double)(dt0 * v[k]), 0.5), n + 0.5);
+        int i0 = (int)floor(x), j0 = (int)floor(y);
+        double s1 = x - i0, s0 = 1 - s1, t1 = y - j0, t0 = 1 - t1;
+        int k00 = j0 * w + i0;
+        #define SAMPLE(f) (T)(s0 * (t0 * f[k00] + t1 * f[k00 + w]) + s1 * (t0 * f[k00 + 1] + t1 * f[k00 + w + 1]))
+        a[k] = SAMPLE(a0);
+        if (count > 1) b[k] = SAMPLE(b0);
+        if (count > 2) c[k] = SAMPLE(c0);
+        ''',
+        'advect')
+
+def advect_cpu(srcs, dsts, u, v, dt0):
+    n = u.shape[0] - 2
+    for r in prange(1, n + 1):
+        for q in range(1, n + 1):
+            x = np.float64(min(max(np.float64(q) - np.float64(dt0 * u[r, q]), 0.5), n + 0.5))
+            y = np.float64(min(max(np.float64(r) - np.float64(dt0 * v[r, q]), 0.5), n + 0.5))
+            i0, j0 = int(np.floor(x)), int(np.floor(y))
+            s1 = x - i0
+            s0 = 1 - s1
+            t1 = y - j0
+            t0 = 1 - t1
+            for f in range(len(srcs)):
+                d0 = srcs[f]
+                dsts[f][r, q] = (s0 * (t0 * d0[j0, i0] + t1 * d0[j0+1, i0]) +
+                                 s1 * (t0 * d0[j0, i0+1] + t1 * d0[j0+1, i0+1]))
+
+if numba is not None:
+    advect_cpu = numba.njit(parallel=True)(advect_cpu)
+
+_advection_grids = {}
+
+def advection_grid(n):
+    # Cell-centre coordinates (row j, column i) of the interior, built once per grid size.
+    grid = _advection_grids.get(n)
+    if grid is None:
+        j, i = np.meshgrid(np.arange(1, n + 1), np.arange(1, n + 1), indexing='ij')
+        grid = _advection_grids[n] = (j.astype(np.float64), i.astype(np.float64))
+    return grid
+
+def advect_numpy(fields, u, v, dt0):
+    # Same arithmetic as the kernels, staged through preallocated buffers. The
+    # four corner samples are gathered with take() from offset views of the
+    # flattened source, so no index arrays are built per call.
+    n = u.shape[0] - 2
+    w = n + 2
+    j, i = advection_grid(n)
+    x, y, s0, t0, acc, tmp, tmp2 = (scratch(np, name, (n, n), np.float64) for name in
+                                    ('advect_x', 'advect_y', 'advect_s0', 'advect_t0',
+                                     'advect_acc', 'advect_tmp', 'advect_tmp2'))
+    trace = scratch(np, 'advect_trace', (n, n), u.dtype)
+    k00 = scratch(np, 'advect_k00', (n, n), np.intp)
+    # Trace backwards in time and clamp to valid coordinates
+    np.multiply(u[1:-1, 1:-1], dt0, out=trace)
+    np.subtract(i, trace, out=x)
+    np.clip(x, 0.5, n + 0.5, out=x)
+    np.multiply(v[1:-1, 1:-1], dt0, out=trace)
+    np.subtract(j, trace, out=y)
+    np.clip(y, 0.5, n + 0.5, out=y)
+    # Flat index of the lower-left sample, then the weights (x and y become s1 and t1)
+    np.floor(x, out=s0)
+    np.floor(y, out=t0)
+    np.multiply(t0, w, out=acc)
+    acc += s0
+    np.copyto(k00, acc, casting='unsafe')
+    x -= s0
+    y -= t0
+    np.subtract(1, x, out=s0)
+    np.subtract(1, y, out=t0)
+    for b, d, d0 in fields:
+        src = d0.ravel()
+        g = scratch(np, 'advect_sample', (n, n), d0.dtype)
+        np.take(src, k00, out=g, mode='clip')
+        np.multiply(t0, g, out=acc)
+        np.take(src[w:], k00, out=g, mode='clip')
+        np.multiply(y, g, out=tmp)
+        acc += tmp
+        acc *= s0
+        np.take(src[1:], k00, out=g, mode='clip')
+        np.multiply(t0, g, out=tmp)
+        np.take(src[w + 1:], k00, out=g, mode='clip')
+        np.multiply(y, g, out=tmp2)
+        tmp += tmp2
+        tmp *= x
+        acc += tmp
+        d[1:-1, 1:-1] = acc
+
+def advect_fields(fields, u, v):
+    # Advect each (b, d, d0) in fields along (u, v), writing d from d0.
+    xp = array_module(u)
+    n = u.shape[0] - 2
+    dt0 = u.dtype.type(dt * n)
+    if xp is not np:
+        for start in range(0, len(fields), 3):
+            group = fields[start:start + 3]
+            srcs = [d0 for b, d, d0 in group]
+            dsts = [d for b, d, d0 in group]
+            srcs += srcs[:1] * (3 - len(group))
+            dsts += dsts[:1] * (3 - len(group))
+            advect_kernel(u, v, *srcs, *dsts, dt0, n, len(group), size=n * n)
+    elif numba is not None:
+        advect_cpu(tuple(d0 for b, d, d0 in fields), tuple(d for b, d, d0 in fields), u, v, dt0)
+    else:
+        advect_numpy(fields, u, v, dt0)
+    for b, d, d0 in fields:
+        set_bnd(b, d)
+
 def advect(b, d, d0, u, v):
-    dt0 = dt * N
-    # Create a grid of indices
-    j, i = cp.meshgrid(cp.arange(1, N+1), cp.arange(1, N+1), indexing='ij')
-    # Trace backwards in time
-    x = i - dt0 * u[1:-1, 1:-1]
-    y = j - dt0 * v[1:-1, 1:-1]
-    # Clamp to valid coordinates
-    x = cp.clip(x, 0.5, N + 0.5)
-    y = cp.clip(y, 0.5, N + 0.5)
-    
-    i0 = cp.floor(x).astype(cp.int32)
-    i1 = i0 + 1
-    j0 = cp.floor(y).astype(cp.int32)
-    j1 = j0 + 1
-
-    s1 = x - i0
-    s0 = 1 - s1
-    t1 = y - j0
-    t0 = 1 - t1
-
-    # Bilinear interpolation
-    d_interp = (s0 * (t0 * d0[j0, i0] + t1 * d0[j1, i0]) +
-                s1 * (t0 * d0[j0, i1] + t1 * d0[j1, i1]))
-    d[1:-1, 1:-1] = d_interp
-    set_bnd(b, d)
+    advect_fields(((b, d, d0),), u, v)
+
+# Pressure Poisson solvers. The system is A p = div with A the 5-point operator
+# 4 p - (sum of neighbours) and zero-gradient boundaries (set_bnd(0, .)), which is
+# what lin_solve(0, p, div, 1, 4) iterates on. A is singular (constants are in
+# its null space), so the iterative solvers work on the mean-free part of div.
+# Each solve appends {'solver', 'iterations', 'residual'} to pressure_stats,
+# where residual is ||div - A p|| / ||div||.
+pressure_stats = deque(maxlen=64)
+
+def poisson(x, out, f=None):
+    # out = A x on the interior, or the residual f - A x when f is given.
+    xp = array_module(x)
+    set_bnd(0, x)
+    o = out[1:-1, 1:-1]
+    t = scratch(xp, 'poisson', o.shape, x.dtype)
+    xp.multiply(x[1:-1, 1:-1], 4, out=t)
+    t -= x[0:-2, 1:-1]
+    t -= x[2:  , 1:-1]
+    t -= x[1:-1, 0:-2]
+    t -= x[1:-1, 2:  ]
+    if f is None:
+        o[...] = t
+    else:
+        xp.subtract(f[1:-1, 1:-1], t, out=o)
+
+def dot(a, b):
+    # Inner product over the whole padded array; callers keep one side's padding at zero.
+    xp = array_module(a)
+    out = scratch(xp, 'dot', (), a.dtype)
+    xp.dot(a.ravel(), b.ravel(), out=out)
+    return float(out)
+
+def pressure_rhs(div):
+    # Mean-free copy of div with zero padding, so it lies in the range of A.
+    xp = array_module(div)
+    f = scratch(xp, 'pressure_rhs', div.shape, div.dtype, zero=True)
+    fi = f[1:-1, 1:-1]
+    fi[...] = div[1:-1, 1:-1]
+    mean = scratch(xp, 'pressure_mean', (), div.dtype)
+    xp.sum(fi, out=mean)
+    mean /= fi.size
+    fi -= mean
+    return f
+
+def relative_residual(p, f):
+    r = scratch(array_module(p), 'pressure_residual', p.shape, p.dtype, zero=True)
+    poisson(p, r, f)
+    norm = dot(f, f)
+    return (dot(r, r) / norm) ** 0.5 if norm else 0.0
+
+def smooth(x, f, sweeps, order=(0, 1)):
+    # Red-black Gauss-Seidel on A x = f. Reversing the colour order on the way
+    # up keeps the V-cycle symmetric, which PCG needs of its preconditioner.
+    one, four = x.dtype.type(1), x.dtype.type(4)
+    set_bnd(0, x)
+    for k in range(sweeps):
+        for parity in order:
+            red_black_sweep(x, f, one, four, parity)
+        set_bnd(0, x)
+
+def multigrid_levels(xp, shape, dtype):
+    # [x, f, r] per level, halving the grid while the interior size stays even.
+    # Sizes with few factors of two coarsen less and lean on the coarse sweeps.
+    levels = []
+    n = shape[0] - 2
+    while True:
+        level_shape = (n + 2, n + 2)
+        levels.append([scratch(xp, name, level_shape, dtype, zero=True) for name in ('mg_x', 'mg_f', 'mg_r')])
+        if n % 2 or n <= 4:
+            return levels
+        n //= 2
+
+def restrict(r, fc):
+    # Coarse right-hand side: the sum of the four children's residuals, since the
+    # coarse operator has twice the spacing but the same unscaled stencil.
+    fi = fc[1:-1, 1:-1]
+    array_module(r).add(r[1:-1:2, 1:-1:2], r[2:-1:2, 1:-1:2], out=fi)
+    fi += r[1:-1:2, 2:-1:2]
+    fi += r[2:-1:2, 2:-1:2]
+
+def prolong_add(e, x):
+    # Bilinear cell-centred interpolation of the coarse correction e into x:
+    # 9/16 of the parent, 3/16 of each side neighbour and 1/16 of the diagonal.
+    xp = array_module(e)
+    n = e.shape[0] - 2
+    t = scratch(xp, 'prolong_t', (n, n), e.dtype)
+    w = scratch(xp, 'prolong_w', (n, n), e.dtype)
+    for di, rows in ((0, slice(0, -2)), (1, slice(2, None))):
+        for dj, cols in ((0, slice(0, -2)), (1, slice(2, None))):
+            xp.add(e[rows, 1:-1], e[1:-1, cols], out=t)
+            t *= 3
+            t += e[rows, cols]
+            xp.multiply(e[1:-1, 1:-1], 9, out=w)
+            t += w
+            t *= 0.0625
+            x[1 + di:-1:2, 1 + dj:-1:2] += t
+
+def v_cycle(levels, k=0, sweeps=2):
+    x, f, r = levels[k]
+    if k == len(levels) - 1:
+        n = x.shape[0] - 2
+        smooth(x, f, min(n * n, 200))
+        return
+    smooth(x, f, sweeps)
+    poisson(x, r, f)
+    xc, fc, rc = levels[k + 1]
+    restrict(r, fc)
+    xc.fill(0)
+    v_cycle(levels, k + 1, sweeps)
+    prolong_add(xc, x)
+    smooth(x, f, sweeps, order=(1, 0))
+
+def multigrid(p, div):
+    # Geometric multigrid V-cycles until the relative residual drops below pressure_tol.
+    f = pressure_rhs(div)
+    levels = multigrid_levels(array_module(p), p.shape, p.dtype)
+    levels[0][:2] = p, f
+    residual = relative_residual(p, f)
+    iterations = 0
+    while residual > pressure_tol and iterations < pressure_max_iter:
+        v_cycle(levels)
+        iterations += 1
+        residual = relative_residual(p, f)
+    return iterations, residual
+
+def pcg(p, div):
+    # Conjugate gradient preconditioned with one multigrid V-cycle (MGPCG).
+    xp = array_module(p)
+    f = pressure_rhs(div)
+    r, z, d, q, t = (scratch(xp, name, p.shape, p.dtype, zero=True)
+                     for name in ('pcg_r', 'pcg_z', 'pcg_d', 'pcg_q', 'pcg_t'))
+    levels = multigrid_levels(xp, p.shape, p.dtype)
+    levels[0][:2] = z, r
+    norm = dot(f, f) ** 0.5
+    poisson(p, r, f)
+    residual = dot(r, r) ** 0.5 / norm if norm else 0.0
+    iterations = 0
+    if residual <= pressure_tol:
+        return iterations, residual
+    z.fill(0)
+    v_cycle(levels)
+    d[...] = z
+    rz = dot(r, z)
+    while iterations < pressure_max_iter:
+        iterations += 1
+        poisson(d, q)
+        alpha = rz / dot(d, q)
+        xp.multiply(d, alpha, out=t)
+        p += t
+        xp.multiply(q, alpha, out=t)
+        r -= t
+        residual = dot(r, r) ** 0.5 / norm
+        if residual <= pressure_tol:
+            break
+        z.fill(0)
+        v_cycle(levels)
+        rz, rz_old = dot(r, z), rz
+        d *= rz / rz_old
+        d += z
+    set_bnd(0, p)
+    return iterations, residual
+
+def fixed_iterations(p, div):
+    # The original scheme: iter sweeps of lin_solve, whatever the residual.
+    lin_solve(0, p, div, 1, 4)
+    return iter, relative_residual(p, pressure_rhs(div))
+
+PRESSURE_SOLVERS = {'fixed': fixed_iterations, 'multigrid': multigrid, 'pcg': pcg}
+
+def solve_pressure(p, div):
+    iterations, residual = PRESSURE_SOLVERS[pressure_solver](p, div)
+    pressure_stats.append({'solver': pressure_solver, 'iterations': iterations, 'residual': residual})
 
 def project(u, v, p, div):
+    xp = array_module(u)
+    t = scratch(xp, 'project', (u.shape[0] - 2, u.shape[1] - 2), u.dtype)
     # Compute divergence and initialize pressure field
-    div[1:-1, 1:-1] = -0.5 * (u[2:, 1:-1] - u[0:-2, 1:-1] +
-                              v[1:-1, 2:] - v[1:-1, 0:-2]) / N
+    xp.subtract(u[2:, 1:-1], u[0:-2, 1:-1], out=t)
+    t += v[1:-1, 2:]
+    t -= v[1:-1, 0:-2]
+    t *= -0.5
+    t /= N
+    div[1:-1, 1:-1] = t
     p.fill(0)
     set_bnd(0, div)
     set_bnd(0, p)
     
-    lin_solve(0, p, div, 1, 4)
+    solve_pressure(p, div)
     
     # Subtract gradient of pressure from velocity field
-    u[1:-1, 1:-1] -= 0.5 * N * (p[2:, 1:-1] - p[0:-2, 1:-1])
-    v[1:-1, 1:-1] -= 0.5 * N * (p[1:-1, 2:] - p[1:-1, 0:-2])
+    xp.subtract(p[2:, 1:-1], p[0:-2, 1:-1], out=t)
+    t *= 0.5 * N
+    u[1:-1, 1:-1] -= t
+    xp.subtract(p[1:-1, 2:], p[1:-1, 0:-2], out=t)
+    t *= 0.5 * N
+    v[1:-1, 1:-1] -= t
     set_bnd(1, u)
     set_bnd(2, v)
 
+# The stepping functions treat each field and its *_prev array as a double
+# buffer. Before advection, "copy current into previous" is a swap of the two
+# arrays' roles (advection rewrites every cell of the destination), so they
+# return the buffers in their new roles and callers must rebind them.
+# Diffusion iterates from the current values, so there the previous buffer is
+# refreshed in place instead.
 def velocity_step(u, v, u0, v0):
     add_source(u, u0)
     add_source(v, v0)
-    u0[:] = u.copy()
-    v0[:] = v.copy()
+    u0[...] = u
+    v0[...] = v
     diffuse(1, u, u0, visc)
     diffuse(2, v, v0, visc)
     project(u, v, u0, v0)
-    u0[:] = u.copy()
-    v0[:] = v.copy()
-    advect(1, u, u0, u0, v0)
-    advect(2, v, v0, u0, v0)
+    u, u0 = u0, u
+    v, v0 = v0, v
+    advect_fields(((1, u, u0), (2, v, v0)), u0, v0)
     project(u, v, u0, v0)
+    return u, v, u0, v0
 
 def density_step(x, x0, u, v):
     add_source(x, x0)
-    x0[:] = x.copy()
+    x0[...] = x
     diffuse(0, x, x0, diff)
-    x0[:] = x.copy()
+    x, x0 = x0, x
     advect(0, x, x0, u, v)
+    return x, x0
+
+class AllocationMeter:
+    # Measures allocations made inside a `with` block. On CuPy every memory-pool
+    # request is counted (count, bytes). NumPy's short-lived buffers cannot be
+    # counted, so there tracemalloc reports the peak bytes held above the
+    # starting point and count stays None. That peak never drops below the
+    # ufunc iterator's fixed buffer (about 64 KiB for strided operands), but a
+    # step free of temporaries keeps it there at any grid size.
+    def __init__(self, xp, enabled=True):
+        self.xp = xp
+        self.enabled = enabled
+        self.count = None
+        self.bytes = 0
+
+    def __enter__(self):
+        if not self.enabled:
+            pass
+        elif self.xp is np:
+            self.started = not tracemalloc.is_tracing()
+            if self.started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.baseline = tracemalloc.get_traced_memory()[0]
+        else:
+            self.count = 0
+            self.hook = PoolRequestHook(self)
+            self.hook.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.enabled:
+            pass
+        elif self.xp is np:
+            self.bytes = tracemalloc.get_traced_memory()[1] - self.baseline
+            if self.started:
+                tracemalloc.stop()
+        else:
+            self.hook.__exit__(*exc)
+
+if cp is not None:
+    class PoolRequestHook(cp.cuda.MemoryHook):
+        name = 'PoolRequestHook'
+
+        def __init__(self, meter):
+            self.meter = meter
+
+        def malloc_preprocess(self, **kwargs):
+            self.meter.count += 1
+            self.meter.bytes += kwargs['size']
+
+# Allocation measurements for recent steps, appended by run_simulation(log_stats=True).
+allocation_stats = deque(maxlen=64)
 
 # Example: initialize a density blob and a velocity source
 def add_initial_conditions():
     # Place a density blob in the center
     cx, cy = N // 2, N // 2
     r = 10
-    Y, X = cp.ogrid[:N+2, :N+2]
+    Y, X = array_module(dens_prev).ogrid[:N+2, :N+2]
     mask = (X - cx)**2 + (Y - cy)**2 <= r**2
     dens_prev[mask] = 100.0
 
@@ -128,13 +677,15 @@ def add_initial_conditions():
     u_prev[cy-5:cy+5, cx-5:cx+5] = 5.0
 
 # Main simulation loop
-def run_simulation(steps=200, display_interval=20):
+def run_simulation(steps=200, display_interval=20, log_stats=False):
     global u, v, u_prev, v_prev, dens, dens_prev
+    if plt is None:
+        display_interval = 0  # matplotlib is not installed; run headless
     add_initial_conditions()
     
     # For pressure solve in project()
-    p   = cp.zeros(shape, dtype=cp.float32)
-    div = cp.zeros(shape, dtype=cp.float32)
+    p   = xp.zeros(shape, dtype=xp.float32)
+    div = xp.zeros(shape, dtype=xp.float32)
     
     for step in range(steps):
         # Clear previous source arrays
@@ -145,19 +696,52 @@ def run_simulation(steps=200, display_interval=20):
         # Here you could update u_prev, v_prev, dens_prev based on user input or external forces
         
         # Step velocity and density fields
-        velocity_step(u, v, u_prev, v_prev)
-        density_step(dens, dens_prev, u, v)
+        pressure_stats.clear()
+        with AllocationMeter(xp, log_stats) as allocations:
+            u, v, u_prev, v_prev = velocity_step(u, v, u_prev, v_prev)
+            dens, dens_prev = density_step(dens, dens_prev, u, v)
+        if log_stats:
+            allocation_stats.append({'count': allocations.count, 'bytes': allocations.bytes})
+            solves = ", ".join(f"{s['iterations']} it -> {s['residual']:.2e}" for s in pressure_stats)
+            if allocations.count is None:
+                allocated = f"peak temporaries {allocations.bytes} B"
+            else:
+                allocated = f"{allocations.count} allocations ({allocations.bytes} B)"
+            print(f"step {step}: pressure ({pressure_solver}) {solves}; {allocated}")
         
-        if step % display_interval == 0:
+        if display_interval and step % display_interval == 0:
             # Bring the density field back to CPU for visualization
-            dens_cpu = cp.asnumpy(dens)
+            dens_cpu = to_numpy(dens)
             plt.clf()
             plt.imshow(dens_cpu[1:-1, 1:-1], cmap='inferno', origin='lower')
             plt.title(f"Density at step {step}")
             plt.pause(0.001)
-    plt.show()
+    if display_interval:
+        plt.show()
+    return dens
 
 if __name__ == "__main__":
-    # Ensure interactive plotting mode is on
-    plt.ion()
-    run_simulation()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Stable-fluids simulation on NumPy or CuPy.")
+    parser.add_argument('--backend', choices=['auto', 'numpy', 'cupy'], default=None,
+                        help="Array backend (default: $FLUID_BACKEND or auto).")
+    parser.add_argument('--size', type=int, default=N, help="Grid size N (N x N cells).")
+    parser.add_argument('--solver', choices=sorted(LIN_SOLVERS), default=solver,
+                        help="Linear solver (default: $FLUID_SOLVER or jacobi).")
+    parser.add_argument('--pressure', choices=sorted(PRESSURE_SOLVERS), default=pressure_solver,
+                        help="Pressure solver (default: $FLUID_PRESSURE or fixed).")
+    parser.add_argument('--tol', type=float, default=pressure_tol,
+                        help="Relative residual at which multigrid/pcg stop.")
+    parser.add_argument('--stats', action='store_true', help="Print pressure iterations and residuals per step.")
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--display-interval', type=int, default=20, help="0 runs headless.")
+    args = parser.parse_args()
+    init_fields(args.backend, args.size)
+    solver = args.solver
+    pressure_solver, pressure_tol = args.pressure, args.tol
+    if plt is None:
+        args.display_interval = 0
+    print(f"Running {args.steps} steps on a {N}x{N} grid with {xp.__name__} ({solver}).")
+    if args.display_interval:
+        # Ensure interactive plotting mode is on
+        plt.ion()
+    run_simulation(args.steps, args.display_interval, args.stats)
\ No newline at end of file
@@ -1,11 +1,42 @@
-from flask import Flask, request, send_file, render_template, redirect, url_for, flash, make_response
-from PIL import Image, ImageFilter, ImageFont, ImageDraw, ImageOps, ImageEnhance
-from werkzeug.utils import secure_filename
+from flask import Flask, Request, current_app, g, has_request_context, request, send_file, render_template, redirect, url_for, flash, make_response, Response, jsonify
+from PIL import Image, ImageFilter, ImageFont, ImageDraw, ImageOps, ImageEnhance, ImageStat, ImageChops
+from werkzeug.utils import safe_join, secure_filename
+from werkzeug.wsgi import FileWrapper
 import os
 import logging
 import datetime
+import time
+import sys
 import zipfile
 import uuid
+import hashlib
+import threading
+import functools
+import inspect
+import itertools
+import contextlib
+import io
+import tempfile
+import multiprocessing
+import asyncio
+import struct
+import zlib
+import random
+import cProfile
+import pstats
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
 
 app = Flask(__name__)
 
@@ -23,225 +54,1213 @@ os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
+# Uploads up to this size stay in memory; larger ones spill to an anonymous temp file.
+app.config['UPLOAD_SPOOL_MAX_BYTES'] = int(os.environ.get('UPLOAD_SPOOL_MAX_BYTES', 16 * 1024 * 1024))
+# Upper bound on the bytes kept on disk by the transform result cache.
+app.config['RESULT_CACHE_MAX_BYTES'] = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Evicted cache files stay on disk this long, so requests that were just handed one can still send it.
+app.config['RESULT_CACHE_EVICT_GRACE_SECONDS'] = float(os.environ.get('RESULT_CACHE_EVICT_GRACE_SECONDS', 60))
+app.config['ENCODE_WORKERS'] = int(os.environ.get('ENCODE_WORKERS', min(8, os.cpu_count() or 1)))
+app.config['FONT_CACHE_SIZE'] = int(os.environ.get('FONT_CACHE_SIZE', 32))
+# 'fused' collapses runs of point filters into shared lookup tables; 'pillow' applies them one at a time.
+app.config['POINT_FILTER_BACKEND'] = os.environ.get('POINT_FILTER_BACKEND', 'fused')
+# Background job mode: worker processes and the most jobs allowed in flight.
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1))
+app.config['JOB_QUEUE_DEPTH'] = int(os.environ.get('JOB_QUEUE_DEPTH', 4 * app.config['JOB_WORKERS']))
+app.config['BATCH_MAX_FILES'] = int(os.environ.get('BATCH_MAX_FILES', 200))
+# Batch archive limits on uncompressed size, per entry and in total, so a small ZIP cannot inflate unbounded.
+app.config['BATCH_MAX_ENTRY_BYTES'] = int(os.environ.get('BATCH_MAX_ENTRY_BYTES', 64 * 1024 * 1024))
+app.config['BATCH_MAX_TOTAL_BYTES'] = int(os.environ.get('BATCH_MAX_TOTAL_BYTES', 1024 * 1024 * 1024))
+# How long a batch waits for room in the job queue before listing a file as failed.
+app.config['BATCH_QUEUE_WAIT_SECONDS'] = float(os.environ.get('BATCH_QUEUE_WAIT_SECONDS', 60))
+# Retention: files older than the TTL are removed, then the oldest until under the size cap.
+app.config['OUTPUT_TTL_SECONDS'] = int(os.environ.get('OUTPUT_TTL_SECONDS', 24 * 60 * 60))
+app.config['OUTPUT_MAX_BYTES'] = int(os.environ.get('OUTPUT_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+app.config['JANITOR_INTERVAL_SECONDS'] = int(os.environ.get('JANITOR_INTERVAL_SECONDS', 300))
+# Serve UUID-named outputs as immutable (ETag, long max-age, ranges) instead of no-cache.
+app.config['IMMUTABLE_DOWNLOADS'] = os.environ.get('IMMUTABLE_DOWNLOADS', '1') == '1'
+app.config['IMMUTABLE_MAX_AGE'] = int(os.environ.get('IMMUTABLE_MAX_AGE', 365 * 24 * 60 * 60))
+# Guardrails: largest accepted image, and the estimated working set allowed per process.
+app.config['MAX_IMAGE_PIXELS'] = int(os.environ.get('MAX_IMAGE_PIXELS', 64 * 1024 * 1024))
+app.config['MEMORY_BUDGET_BYTES'] = int(os.environ.get('MEMORY_BUDGET_BYTES', 1024 * 1024 * 1024))
+app.config['MEMORY_WAIT_SECONDS'] = float(os.environ.get('MEMORY_WAIT_SECONDS', 30))
+# Encode profiles (see ENCODE_PROFILES) for transform outputs and previews, downloads, and icon sets.
+app.config['OUTPUT_PROFILE'] = os.environ.get('OUTPUT_PROFILE', 'fast')
+app.config['DOWNLOAD_PROFILE'] = os.environ.get('DOWNLOAD_PROFILE', 'archive')
+app.config['ICON_PROFILE'] = os.environ.get('ICON_PROFILE', 'default')
+# Formats offered instead of PNG on downloads when the Accept header prefers them, e.g. 'webp,jpeg'.
+app.config['NEGOTIATE_FORMATS'] = [f.strip() for f in os.environ.get('NEGOTIATE_FORMATS', '').lower().split(',') if f.strip()]
+# Canvas rows composited and encoded at a time; compositing memory scales with this, not the canvas.
+app.config['COMPOSITE_TILE_ROWS'] = int(os.environ.get('COMPOSITE_TILE_ROWS', 256))
+# Async serving (SERVER_MODE=asgi): threads for app and Pillow work, and the file send chunk size.
+app.config['ASYNC_WORKERS'] = int(os.environ.get('ASYNC_WORKERS', 2 * (os.cpu_count() or 1)))
+app.config['ASYNC_FILE_CHUNK_BYTES'] = int(os.environ.get('ASYNC_FILE_CHUNK_BYTES', 256 * 1024))
+# Opt-in profiling: fraction of requests run under cProfile, and the duration worth reporting.
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_SLOW_SECONDS'] = float(os.environ.get('PROFILE_SLOW_SECONDS', 1.0))
+# Slow-request profiles are also dumped here as .prof files when set.
+app.config['PROFILE_FOLDER'] = os.environ.get('PROFILE_FOLDER')
+
+# Let Pillow refuse anything we did not size-check ourselves (e.g. template assets).
+Image.MAX_IMAGE_PIXELS = app.config['MAX_IMAGE_PIXELS']
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class SpoolingRequest(Request):
+    """
+    Request that keeps uploaded files in memory up to UPLOAD_SPOOL_MAX_BYTES
+    and spills larger ones to an anonymous temporary file in UPLOAD_FOLDER.
+    Spilled files have no directory entry and vanish when the request closes.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=current_app.config['UPLOAD_SPOOL_MAX_BYTES'],
+                                             dir=current_app.config['UPLOAD_FOLDER'])
+
+app.request_class = SpoolingRequest
+
+def upload_source(file):
+    """
+    Return the seekable binary stream backing an uploaded file, for handing
+    straight to Image.open or the transform functions.
+    """
+    return file.stream
+
 def unique_filename(prefix='image', ext='png'):
     """Generate a unique filename using UUID."""
     return f"{prefix}_{uuid.uuid4().hex}.{ext}"
 
-def apply_filter_to_image(input_path, filter_type):
+def output_path_for(filename, create=False):
     """
-    Apply different filters to the image. Returns output_path if successful, else None.
+    Sharded location of an output file: OUTPUT_FOLDER/<xx>/<filename>, where
+    xx comes from a hash of the name, so no single directory grows unbounded.
+    """
+    shard_dir = os.path.join(app.config['OUTPUT_FOLDER'], hashlib.md5(filename.encode()).hexdigest()[:2])
+    if create:
+        os.makedirs(shard_dir, exist_ok=True)
+    return os.path.join(shard_dir, filename)
+
+def new_output_path(prefix, ext='png'):
+    """Path for a new uniquely named output file, with its shard directory created."""
+    return output_path_for(unique_filename(prefix, ext), create=True)
+
+def resolve_output(filename):
+    """
+    Existing path for an output filename, or None. Also finds pre-sharding flat
+    files, and files inside an output directory named as '<directory>/<path>'.
+    """
+    directory, _, rest = filename.partition('/')
+    if rest:
+        path = safe_join(output_path_for(directory), rest) if directory not in ('', '.', '..') else None
+        return path if path and os.path.isfile(path) else None
+    for path in (output_path_for(filename), os.path.join(app.config['OUTPUT_FOLDER'], filename)):
+        if os.path.isfile(path):
+            return path
+    return None
+
+def output_name(path):
+    """The name resolve_output() maps back to path: its location below the shard directory."""
+    name = os.path.relpath(path, app.config['OUTPUT_FOLDER']).replace(os.sep, '/')
+    return name.split('/', 1)[1] if '/' in name else name
+
+def remove_empty_parents(path, folder):
+    """
+    After deleting path, remove the directories above it that are now empty
+    (nested icon set folders), stopping at folder's shard directories.
+    """
+    parent = os.path.dirname(path)
+    while parent != folder and os.path.dirname(parent) != folder:
+        try:
+            os.rmdir(parent)
+        except OSError:
+            return
+        parent = os.path.dirname(parent)
+
+class Metrics:
     """
-    output_path = None
+    In-process registry of labelled counters and histograms, rendered in the
+    Prometheus text exposition format for /metrics. Gauges are not stored;
+    they are read from the live objects at scrape time.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.help = {}  # name -> help text
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * (len(self.BUCKETS) + 2)
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(
+            '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for k, v in pairs) + '}'
+
+    def render(self, samples=()):
+        """
+        Text exposition of every stored series, followed by the scrape-time
+        (name, type, help, labels, value) samples; None values are skipped.
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(series)) for key, series in self.histograms.items())
+        lines = []
+        seen = set()
+
+        def header(name, kind, help_text):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, 'counter', self.help.get(name, name))
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), series in histograms:
+            header(name, 'histogram', self.help.get(name, name))
+            for bound, count in zip(self.BUCKETS, series):
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{name}_sum{self._labels(labels)} {series[-2]}")
+            lines.append(f"{name}_count{self._labels(labels)} {series[-1]}")
+        for name, kind, help_text, labels, value in samples:
+            if value is None:
+                continue
+            header(name, kind, help_text)
+            lines.append(f"{name}{self._labels(sorted(labels.items()))} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('xcode_request_duration_seconds', 'Request latency, including streamed bodies.')
+metrics.describe('xcode_stage_duration_seconds', 'Time spent in each processing stage.')
+metrics.describe('xcode_request_bytes_total', 'Request body bytes received.')
+metrics.describe('xcode_response_bytes_total', 'Response body bytes sent.')
+metrics.describe('xcode_result_cache_lookups_total', 'Result cache lookups by operation and outcome.')
+
+@contextlib.contextmanager
+def timed_stage(stage):
+    """Record the time spent in the with-block under xcode_stage_duration_seconds."""
+    start = time.perf_counter()
     try:
-        with Image.open(input_path) as img:
-            img = img.convert('RGBA')
-
-            filter_map = {
-                'gaussian_blur': ImageFilter.GaussianBlur(5),
-                'blur': ImageFilter.BLUR,
-                'contour': ImageFilter.CONTOUR,
-                'detail': ImageFilter.DETAIL,
-                'edge_enhance': ImageFilter.EDGE_ENHANCE,
-                'edge_enhance_more': ImageFilter.EDGE_ENHANCE_MORE,
-                'emboss': ImageFilter.EMBOSS,
-                'find_edges': ImageFilter.FIND_EDGES,
-                'sharpen': ImageFilter.SHARPEN,
-                'smooth': ImageFilter.SMOOTH,
-                'smooth_more': ImageFilter.SMOOTH_MORE
+        yield
+    finally:
+        metrics.observe('xcode_stage_duration_seconds', time.perf_counter() - start, stage=stage)
+
+class ResultCache:
+    """
+    Content-addressed cache of transform outputs stored in OUTPUT_FOLDER.
+    Entries are keyed by a hash of the input bytes plus the operation and its
+    parameters. Once the cached artifacts exceed max_bytes, the least recently
+    used ones are evicted, and deleted from disk grace_seconds later: get()
+    may have just returned them to a request that has not opened them yet.
+    """
+    def __init__(self, max_bytes, grace_seconds=0):
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.entries = OrderedDict()  # key -> (result, paths, size)
+        self.retired = deque()  # (evicted at, paths) awaiting deletion
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(source, op, params):
+        digest = hashlib.sha256()
+        if source is None:
+            pass
+        elif isinstance(source, str):
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        else:
+            source.seek(0)
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                digest.update(chunk)
+            source.seek(0)
+        digest.update(op.encode())
+        digest.update(repr(params).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                result, paths, size = entry
+                if all(os.path.exists(p) for p in paths):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                # Artifact was removed behind our back; forget the entry.
+                del self.entries[key]
+                self.total_bytes -= size
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        paths = [result] if isinstance(result, str) else list(result)
+        size = sum(os.path.getsize(p) for p in paths)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[2]
+            self.entries[key] = (result, paths, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, old_paths, old_size) = self.entries.popitem(last=False)
+                self.total_bytes -= old_size
+                self.retired.append((time.monotonic(), old_paths))
+            self._reap()
+
+    def _reap(self):
+        # Delete evicted artifacts whose grace period is over. Caller holds self.lock.
+        cutoff = time.monotonic() - self.grace_seconds
+        while self.retired and self.retired[0][0] <= cutoff:
+            self._remove(self.retired.popleft()[1])
+
+    @staticmethod
+    def _remove(paths):
+        for p in paths:
+            try:
+                os.remove(p)
+            except OSError as e:
+                logger.warning(f"Could not evict cached file '{p}': {e}")
+                continue
+            # Multi-file results live in their own directory tree; drop it once empty.
+            remove_empty_parents(p, app.config['OUTPUT_FOLDER'])
+
+    def prune(self):
+        """Forget entries whose artifacts were deleted outside the cache, and reap evicted ones."""
+        with self.lock:
+            self._reap()
+            for key, (_, paths, size) in list(self.entries.items()):
+                if not all(os.path.exists(p) for p in paths):
+                    del self.entries[key]
+                    self.total_bytes -= size
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
             }
 
-            # Apply filter based on filter_type
-            if filter_type == 'invert':
-                img = img.convert('RGB')
-                img = ImageOps.invert(img).convert('RGBA')
-            elif filter_type == 'posterize':
-                img = img.convert('RGB')
-                img = ImageOps.posterize(img, bits=4).convert('RGBA')
-            elif filter_type == 'solarize':
-                img = img.convert('RGB')
-                img = ImageOps.solarize(img, threshold=128).convert('RGBA')
-            elif filter_type == 'autocontrast':
-                img = img.convert('RGB')
-                img = ImageOps.autocontrast(img).convert('RGBA')
-            elif filter_type == 'equalize':
-                img = img.convert('RGB')
-                img = ImageOps.equalize(img).convert('RGBA')
-            elif filter_type == 'grayscale':
-                img = img.convert('L').convert('RGBA')
-            elif filter_type == 'colorize':
-                gray_img = img.convert('L')
-                img = ImageOps.colorize(gray_img, black="blue", white="yellow").convert('RGBA')
-            elif filter_type in filter_map:
-                img = img.filter(filter_map[filter_type])
-            elif filter_type.startswith('brightness_'):
-                enhancer = ImageEnhance.Brightness(img)
-                factor = 1.5 if filter_type == 'brightness_up' else 0.5
-                img = enhancer.enhance(factor)
-            elif filter_type.startswith('contrast_'):
-                enhancer = ImageEnhance.Contrast(img)
-                factor = 1.5 if filter_type == 'contrast_up' else 0.5
-                img = enhancer.enhance(factor)
-            elif filter_type.startswith('color_'):
-                enhancer = ImageEnhance.Color(img)
-                factor = 1.5 if filter_type == 'color_up' else 0.5
-                img = enhancer.enhance(factor)
-            elif filter_type.startswith('sharpen_enhance'):
-                enhancer = ImageEnhance.Sharpness(img)
-                factor = 2.0 if filter_type == 'sharpen_enhance_up' else 0.5
-                img = enhancer.enhance(factor)
-            else:
-                logger.warning(f"Filter type '{filter_type}' not recognized. Defaulting to grayscale.")
-                img = img.convert('L').convert('RGBA')
+result_cache = ResultCache(app.config['RESULT_CACHE_MAX_BYTES'], app.config['RESULT_CACHE_EVICT_GRACE_SECONDS'])
+
+def cached_result(op):
+    """
+    Decorator for transforms taking an image source as first argument. Returns
+    the stored artifact for identical input bytes and parameters instead of
+    recomputing it; failed transforms (None) are not cached.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def cache_key(source, *args, **kwargs):
+            bound = signature.bind(source, *args, **kwargs)
+            bound.apply_defaults()
+            return result_cache.make_key(source, op, list(bound.arguments.items())[1:])
+
+        @functools.wraps(fn)
+        def wrapper(source, *args, **kwargs):
+            try:
+                key = cache_key(source, *args, **kwargs)
+            except OSError:
+                return fn(source, *args, **kwargs)
+
+            result = result_cache.get(key)
+            metrics.inc('xcode_result_cache_lookups_total', op=op, result='miss' if result is None else 'hit')
+            if result is not None:
+                return result
+            result = fn(source, *args, **kwargs)
+            if result:
+                result_cache.put(key, result)
+            return result
+        wrapper.cache_key = cache_key
+        # The transform with any inner decorators (e.g. the memory budget) still applied.
+        wrapper.uncached = fn
+        return wrapper
+    return decorator
+
+class ImageTooLarge(Exception):
+    """Raised when an upload has more pixels than MAX_IMAGE_PIXELS."""
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when an operation cannot fit in the memory budget in time."""
+
+class MemoryBudget:
+    """
+    Per-process admission control for image work. Each operation reserves its
+    estimated working set before decoding; it is admitted if it fits, waits
+    for other operations to release memory otherwise, and is rejected if it
+    could never fit or the wait times out.
+    """
+    def __init__(self, limit, timeout):
+        self.limit = limit
+        self.timeout = timeout
+        self.in_use = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self.cond:
+            if nbytes > self.limit:
+                self.rejected += 1
+                raise MemoryBudgetExceeded(f"Operation needs about {nbytes // (1024 * 1024)} MB, "
+                                           f"more than the {self.limit // (1024 * 1024)} MB budget.")
+            if self.in_use + nbytes > self.limit:
+                self.queued += 1
+                if not self.cond.wait_for(lambda: self.in_use + nbytes <= self.limit, self.timeout):
+                    self.rejected += 1
+                    raise MemoryBudgetExceeded("Server is busy with other images. Please retry later.")
+            self.in_use += nbytes
+            self.admitted += 1
+
+    def release(self, nbytes):
+        with self.cond:
+            self.in_use -= nbytes
+            self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, nbytes):
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'limit': self.limit,
+                'in_use': self.in_use,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected': self.rejected,
+            }
+
+memory_budget = MemoryBudget(app.config['MEMORY_BUDGET_BYTES'], app.config['MEMORY_WAIT_SECONDS'])
+
+# Peak working set per operation, as multiples of the source decoded to RGBA:
+# the decode itself plus intermediates and encode buffers.
+OP_MEMORY_FACTORS = {
+    'filters': 3,
+    'convert': 2,
+    'app_icons': 2,
+    'frame': 2,
+    'srgb': 2,
+    'launch_screen': 2,
+    'encode': 2,
+}
+
+def estimate_working_set(source, op, output_pixels=0):
+    """
+    Estimate the peak bytes op needs for source from the image header alone,
+    plus output_pixels for an output whose size does not follow the source.
+    Raises ImageTooLarge when either is above MAX_IMAGE_PIXELS. Unreadable
+    images estimate to 0 so the transform itself reports the decode error.
+    """
+    if output_pixels > app.config['MAX_IMAGE_PIXELS']:
+        raise ImageTooLarge(f"Output of {output_pixels} pixels is over the limit of "
+                            f"{app.config['MAX_IMAGE_PIXELS']} pixels.")
+    try:
+        with Image.open(source) as img:
+            width, height = img.size
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except Exception:
+        return 0
+    finally:
+        if not isinstance(source, str):
+            source.seek(0)
+    if width * height > app.config['MAX_IMAGE_PIXELS']:
+        raise ImageTooLarge(f"Image is {width}x{height}; the limit is "
+                            f"{app.config['MAX_IMAGE_PIXELS']} pixels.")
+    return (width * height + output_pixels) * 4 * OP_MEMORY_FACTORS[op]
+
+def memory_budgeted(op, output_size=None):
+    """
+    Decorator for transforms taking an image source as first argument. Checks
+    the image header and holds a memory budget reservation while fn runs.
+    output_size names the (width, height) argument of transforms that choose
+    their output size, which is then counted too.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(source, *args, **kwargs):
+            output_pixels = 0
+            if output_size is not None:
+                bound = signature.bind(source, *args, **kwargs)
+                bound.apply_defaults()
+                width, height = bound.arguments[output_size]
+                output_pixels = width * height
+            with memory_budget.reserve(estimate_working_set(source, op, output_pixels)):
+                return fn(source, *args, **kwargs)
+        return wrapper
+    return decorator
+
+FILTER_MAP = {
+    'gaussian_blur': ImageFilter.GaussianBlur(5),
+    'blur': ImageFilter.BLUR,
+    'contour': ImageFilter.CONTOUR,
+    'detail': ImageFilter.DETAIL,
+    'edge_enhance': ImageFilter.EDGE_ENHANCE,
+    'edge_enhance_more': ImageFilter.EDGE_ENHANCE_MORE,
+    'emboss': ImageFilter.EMBOSS,
+    'find_edges': ImageFilter.FIND_EDGES,
+    'sharpen': ImageFilter.SHARPEN,
+    'smooth': ImageFilter.SMOOTH,
+    'smooth_more': ImageFilter.SMOOTH_MORE
+}
+
+# ImageOps steps that operate on RGB. Adjacent steps share the RGB image
+# instead of bouncing through RGBA after each one.
+RGB_OPS = {
+    'invert': ImageOps.invert,
+    'posterize': lambda img: ImageOps.posterize(img, bits=4),
+    'solarize': lambda img: ImageOps.solarize(img, threshold=128),
+    'autocontrast': ImageOps.autocontrast,
+    'equalize': ImageOps.equalize,
+}
+
+ENHANCERS = {
+    'brightness_': (ImageEnhance.Brightness, 'brightness_up', 1.5, 0.5),
+    'contrast_': (ImageEnhance.Contrast, 'contrast_up', 1.5, 0.5),
+    'color_': (ImageEnhance.Color, 'color_up', 1.5, 0.5),
+    'sharpen_enhance': (ImageEnhance.Sharpness, 'sharpen_enhance_up', 2.0, 0.5),
+}
+
+def ensure_mode(img, mode):
+    """Convert img to mode only if it is not already in that mode."""
+    return img if img.mode == mode else img.convert(mode)
+
+def apply_filter(img, filter_type):
+    """
+    Apply a single filter to an in-memory image and return the result.
+    The result may be in RGB, L or RGBA mode; callers convert once at the end.
+    """
+    if filter_type in RGB_OPS:
+        return RGB_OPS[filter_type](ensure_mode(img, 'RGB'))
+    if filter_type == 'grayscale':
+        return ensure_mode(img, 'L')
+    if filter_type == 'colorize':
+        return ImageOps.colorize(ensure_mode(img, 'L'), black="blue", white="yellow")
+    if filter_type in FILTER_MAP:
+        return ensure_mode(img, 'RGBA').filter(FILTER_MAP[filter_type])
+    for prefix, (enhancer_cls, up_name, up, down) in ENHANCERS.items():
+        if filter_type.startswith(prefix):
+            factor = up if filter_type == up_name else down
+            return enhancer_cls(ensure_mode(img, 'RGBA')).enhance(factor)
+    logger.warning(f"Filter type '{filter_type}' not recognized. Defaulting to grayscale.")
+    return ensure_mode(img, 'L')
+
+# Filters whose output pixel depends only on the same input pixel.
+POINT_FILTERS = {'invert', 'posterize', 'solarize', 'grayscale', 'colorize'}
+POINT_FILTER_PREFIXES = ('brightness_', 'contrast_', 'color_')
+
+def is_point_filter(filter_type):
+    return filter_type in POINT_FILTERS or filter_type.startswith(POINT_FILTER_PREFIXES)
+
+def enhance_factor(filter_type):
+    for prefix, (_, up_name, up, down) in ENHANCERS.items():
+        if filter_type.startswith(prefix):
+            return up if filter_type == up_name else down
+    return None
+
+def ramp_image(mode):
+    """256x1 image whose every band runs 0..255, for reading ops back as lookup tables."""
+    band = Image.frombytes('L', (256, 1), bytes(range(256)))
+    return Image.merge(mode, [band] * len(mode))
+
+def image_tables(img):
+    """Split a 256x1 image read back from a ramp into per-band 256-entry tables."""
+    return tuple(tuple(band.getdata()) for band in img.split())
 
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], unique_filename('filtered'))
-            img.save(output_path, format='PNG')
+@functools.lru_cache(maxsize=None)
+def point_lut(filter_type):
+    """
+    RGBA lookup tables equivalent to apply_filter for a per-channel filter,
+    read back by running the Pillow implementation over a ramp.
+    """
+    return image_tables(ensure_mode(apply_filter(ramp_image('RGBA'), filter_type), 'RGBA'))
+
+@functools.lru_cache(maxsize=1024)
+def contrast_lut(factor, mean):
+    """RGBA lookup tables for ImageEnhance.Contrast on an image whose luma mean is mean."""
+    ramp = ramp_image('RGBA')
+    degenerate = Image.new('L', ramp.size, mean).convert('RGBA')
+    degenerate.putalpha(ramp.getchannel('A'))
+    return image_tables(Image.blend(degenerate, ramp, factor))
+
+@functools.lru_cache(maxsize=None)
+def colorize_lut():
+    """RGBA lookup tables taking a grayscale value to the 'colorize' filter's output."""
+    rgb = image_tables(ImageOps.colorize(ramp_image('L'), black="blue", white="yellow"))
+    return rgb + ((255,) * 256,)
+
+def compose_luts(first, then):
+    """Tables equivalent to applying first and then then."""
+    if first is None:
+        return then
+    return tuple(tuple(t[v] for v in f) for f, t in zip(first, then))
+
+def apply_point_filters(img, filter_types):
+    """
+    Fused backend for a run of point filters. Consecutive per-channel filters
+    (invert, posterize, solarize, brightness_*, and contrast_* once its mean
+    is known) are composed into one set of RGBA lookup tables and applied in a
+    single Image.point pass. Grayscale and colorize turn the image into a
+    single-band source that later tables read from. Only grayscale, color_*
+    and contrast_* force the pending tables to be applied first. Results match
+    apply_filter exactly.
+
+    The pending tables always act on the RGBA expansion of img, so for an L
+    image every colour channel reads the gray value and alpha reads 255.
+    """
+    lut = None
+
+    def flush(img, lut):
+        if lut is None:
+            return img
+        if img.mode == 'L' and lut[0] == lut[1] == lut[2] and lut[3][255] == 255:
+            # Still gray: apply one table to the single band.
+            return img.point(list(lut[0]))
+        return ensure_mode(img, 'RGBA').point([v for table in lut for v in table])
+
+    img = img if img.mode == 'L' else ensure_mode(img, 'RGBA')
+    for filter_type in filter_types:
+        if filter_type == 'grayscale':
+            img, lut = ensure_mode(flush(img, lut), 'L'), None
+        elif filter_type == 'colorize':
+            img, lut = ensure_mode(flush(img, lut), 'L'), colorize_lut()
+        elif filter_type.startswith('color_'):
+            img, lut = apply_filter(flush(img, lut), filter_type), None
+            img = ensure_mode(img, 'RGBA')
+        elif filter_type.startswith('contrast_'):
+            img = flush(img, lut)
+            mean = int(ImageStat.Stat(ensure_mode(img, 'L')).mean[0] + 0.5)
+            lut = contrast_lut(enhance_factor(filter_type), mean)
+        else:
+            lut = compose_luts(lut, point_lut(filter_type))
+    return flush(img, lut)
+
+def apply_filters(img, filter_types):
+    """
+    Apply filter_types in order. With the fused backend, each run of
+    consecutive point filters goes through one apply_point_filters call.
+    """
+    fused = app.config['POINT_FILTER_BACKEND'] == 'fused'
+    run = []
+    for filter_type in filter_types:
+        if fused and is_point_filter(filter_type):
+            run.append(filter_type)
+            continue
+        if run:
+            img = apply_point_filters(img, run)
+            run = []
+        img = apply_filter(img, filter_type)
+    if run:
+        img = apply_point_filters(img, run)
+    return img
+
+def decode(img):
+    """Force the pixel decode of a lazily opened image, timed as the decode stage."""
+    with timed_stage('decode'):
+        img.load()
+    return img
+
+# Named encoder settings: profile -> (format, save options). 'fast' trades size
+# for speed on throwaway outputs; 'archive' spends the time once for downloads.
+ENCODE_PROFILES = {
+    'fast': ('PNG', {'compress_level': 1}),
+    'default': ('PNG', {'compress_level': 6}),
+    'archive': ('PNG', {'optimize': True}),
+    'webp': ('WEBP', {'quality': 90, 'method': 4}),
+    'webp_lossless': ('WEBP', {'lossless': True, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 90, 'optimize': True, 'progressive': True}),
+}
+# File extension and MIME type per output format.
+OUTPUT_FORMATS = {
+    'PNG': ('png', 'image/png'),
+    'WEBP': ('webp', 'image/webp'),
+    'JPEG': ('jpg', 'image/jpeg'),
+}
+
+def profile_format(profile=None):
+    """Output format of profile, defaulting to OUTPUT_PROFILE."""
+    return ENCODE_PROFILES[profile or app.config['OUTPUT_PROFILE']][0]
+
+def encode_image(img, fp, profile=None):
+    """
+    Encode img to a path or file object with the named profile, timed as the
+    encode stage. JPEG has no alpha, so translucent images are flattened onto white.
+    """
+    fmt, options = ENCODE_PROFILES[profile or app.config['OUTPUT_PROFILE']]
+    if fmt == 'JPEG' and img.mode not in ('RGB', 'L'):
+        img = ensure_mode(img, 'RGBA')
+        flat = Image.new('RGB', img.size, (255, 255, 255))
+        flat.paste(img, mask=img.getchannel('A'))
+        img = flat
+    elif fmt == 'WEBP' and img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+    with timed_stage('encode'):
+        img.save(fp, format=fmt, **options)
+
+def save_output(img, prefix, profile=None):
+    """Encode img into a new output file named for prefix and return its path."""
+    output_path = new_output_path(prefix, OUTPUT_FORMATS[profile_format(profile)][0])
+    encode_image(img, output_path, profile)
+    return output_path
+
+@cached_result('filters')
+@memory_budgeted('filters')
+def apply_filter_pipeline(source, filter_types, profile=None):
+    """
+    Decode the image once, apply every filter in filter_types to the in-memory
+    image and encode only the final result with profile. source is a path or
+    binary stream. Returns output_path if successful, else None.
+    """
+    try:
+        with Image.open(source) as img:
+            img = decode(img).convert('RGBA')
+            with timed_stage('filter'):
+                img = ensure_mode(apply_filters(img, filter_types), 'RGBA')
+
+            output_path = save_output(img, 'filtered', profile)
         return output_path
     except Exception as e:
-        logger.error(f"Error applying filter '{filter_type}': {e}")
+        logger.error(f"Error applying filters {filter_types}: {e}")
         return None
 
-def convert_image(input_path, size=(1024, 1024)):
+def apply_filter_to_image(source, filter_type):
+    """
+    Apply different filters to the image. Returns output_path if successful, else None.
+    """
+    return apply_filter_pipeline(source, [filter_type])
+
+# Decode and pre-reduce to at least this multiple of the target before LANCZOS.
+DOWNSCALE_REDUCING_GAP = 2.0
+
+def open_for_downscale(source, size):
+    """
+    Open source for resizing to size. JPEGs are decoded through draft() at the
+    smallest DCT scale that still covers DOWNSCALE_REDUCING_GAP times the
+    target, so a 6000px photo bound for 1024px never decodes at full size.
+    """
+    img = Image.open(source)
+    if img.format == 'JPEG':
+        img.draft(None, (int(size[0] * DOWNSCALE_REDUCING_GAP), int(size[1] * DOWNSCALE_REDUCING_GAP)))
+    if has_request_context():
+        g.decoded_bytes = g.get('decoded_bytes', 0) + img.width * img.height * len(img.getbands())
+    return img
+
+def downscale(img, size):
+    """
+    LANCZOS resize to size. Large reductions first shrink by an integer
+    factor with reduce(), keeping DOWNSCALE_REDUCING_GAP times the target.
+    """
+    with timed_stage('resize'):
+        return img.resize(size, Image.LANCZOS, reducing_gap=DOWNSCALE_REDUCING_GAP)
+
+@cached_result('convert')
+@memory_budgeted('convert', output_size='size')
+def convert_image(source, size=(1024, 1024)):
     try:
-        with Image.open(input_path) as img:
-            img = img.resize(size, Image.LANCZOS)
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], unique_filename('converted'))
-            img.save(output_path, format='PNG')
+        with open_for_downscale(source, size) as img:
+            img = downscale(decode(img), size)
+            output_path = save_output(img, 'converted')
         return output_path
     except Exception as e:
         logger.error(f"Error converting image: {e}")
         return None
 
-def generate_ios_app_icons(input_path):
-    sizes = [
-        (20, 1), (20, 2), (20, 3),
-        (29, 1), (29, 2), (29, 3),
-        (40, 1), (40, 2), (40, 3),
-        (60, 2), (60, 3),
-        (76, 1), (76, 2),
-        (83.5, 2),
-        (1024, 1)
-    ]
+IOS_ICON_SIZES = [
+    (20, 1), (20, 2), (20, 3),
+    (29, 1), (29, 2), (29, 3),
+    (40, 1), (40, 2), (40, 3),
+    (60, 2), (60, 3),
+    (76, 1), (76, 2),
+    (83.5, 2),
+    (1024, 1)
+]
+ICON_MASTER_SIZE = (1024, 1024)
+
+# Pillow releases the GIL while encoding, so PNG encodes run in parallel here.
+encode_pool = ThreadPoolExecutor(max_workers=app.config['ENCODE_WORKERS'])
+
+def icon_filename(base_size, scale):
+    return f"icon_{base_size}x{base_size}@{scale}x.png".replace('.5', 'p5')
 
-    icon_paths = []
+ANDROID_DENSITIES = [('mdpi', 1), ('hdpi', 1.5), ('xhdpi', 2), ('xxhdpi', 3), ('xxxhdpi', 4)]
+MACOS_ICON_SIZES = [(16, 1), (16, 2), (32, 1), (32, 2), (128, 1), (128, 2), (256, 1), (256, 2), (512, 1), (512, 2)]
+WATCHOS_ICON_SIZES = [
+    (24, 2), (27.5, 2), (29, 2), (29, 3), (33, 2), (40, 2), (44, 2), (46, 2),
+    (50, 2), (51, 2), (54, 2), (86, 2), (98, 2), (108, 2), (117, 2), (129, 2),
+    (1024, 1)
+]
+
+# Every icon each platform needs: (platform, point size, scale, format, filename).
+ICON_MANIFEST = (
+    [('ios', pt, scale, 'png', icon_filename(pt, scale)) for pt, scale in IOS_ICON_SIZES]
+    + [('android', 48, scale, 'png', f"mipmap-{density}/ic_launcher.png") for density, scale in ANDROID_DENSITIES]
+    + [('android', 512, 1, 'png', 'playstore_icon.png')]
+    + [('macos', pt, scale, 'png', f"icon_{pt}x{pt}{'@2x' if scale == 2 else ''}.png") for pt, scale in MACOS_ICON_SIZES]
+    + [('watchos', pt, scale, 'png', icon_filename(pt, scale)) for pt, scale in WATCHOS_ICON_SIZES]
+)
+ICON_PLATFORMS = ('ios', 'android', 'macos', 'watchos')
+# Encode profile per manifest format; PNG icons use ICON_PROFILE.
+ICON_FORMAT_PROFILES = {'webp': 'webp_lossless', 'jpeg': 'jpeg'}
+
+def parse_platforms(text):
+    """
+    Comma-separated platform names to a tuple in ICON_PLATFORMS order.
+    Raises ValueError for unknown or missing platforms.
+    """
+    names = {p.strip().lower() for p in text.split(',') if p.strip()}
+    unknown = names - set(ICON_PLATFORMS)
+    if unknown:
+        raise ValueError(f"Unknown icon platform(s): {', '.join(sorted(unknown))}.")
+    if not names:
+        raise ValueError("No icon platform selected.")
+    return tuple(p for p in ICON_PLATFORMS if p in names)
+
+def icon_targets(platforms):
+    """
+    (pixel size, format, filename) for every manifest entry of platforms.
+    With several platforms each one's files go under a '<platform>/' folder.
+    """
+    nested = len(platforms) > 1
+    return [(int(pt * scale), fmt, f"{platform}/{name}" if nested else name)
+            for platform, pt, scale, fmt, name in ICON_MANIFEST if platform in platforms]
+
+def resize_pyramid(img, pixel_sizes):
+    """
+    Yield (size, image) for each distinct square pixel size, largest first.
+    Each level is resampled from the smallest already built level that is at
+    least twice its size, so only the largest targets touch the source image.
+    """
+    levels = {}
+    source_px = min(img.size)
+    for px in sorted(set(pixel_sizes), reverse=True):
+        parent = None
+        for level_px in sorted(levels):
+            if 2 * px <= level_px <= source_px:
+                parent = levels[level_px]
+                break
+        if parent is None:
+            levels[px] = downscale(img, (px, px))
+        else:
+            with timed_stage('resize'):
+                levels[px] = parent.resize((px, px), Image.LANCZOS)
+        yield px, levels[px]
+
+def encode_icon(img, fmt='png'):
+    buf = io.BytesIO()
+    encode_image(img, buf, ICON_FORMAT_PROFILES.get(fmt, app.config['ICON_PROFILE']))
+    return buf.getvalue()
+
+def iter_app_icons(img, targets):
+    """
+    Yield (filenames, bytes) for each distinct (pixel size, format) among
+    targets, in pyramid order, as soon as its encode finishes. Every pixel
+    size is resampled once for all platforms, and entries sharing a size
+    and format share one encode.
+    """
+    names_by_key = {}
+    for px, fmt, name in targets:
+        names_by_key.setdefault((px, fmt), []).append(name)
+    formats_by_px = {}
+    for px, fmt in names_by_key:
+        formats_by_px.setdefault(px, []).append(fmt)
+
+    pending = deque()
+    for px, icon_img in resize_pyramid(img, formats_by_px):
+        for fmt in formats_by_px[px]:
+            pending.append(((px, fmt), encode_pool.submit(encode_icon, icon_img, fmt)))
+        while pending and pending[0][1].done():
+            key, future = pending.popleft()
+            yield names_by_key[key], future.result()
+    for key, future in pending:
+        yield names_by_key[key], future.result()
+
+@cached_result('app_icons')
+@memory_budgeted('app_icons')
+def generate_app_icons(source, platforms=('ios',)):
+    """
+    Write the icons of every platform in platforms from a single decode of
+    source. Returns the icon paths in manifest order, or None on failure.
+    """
     try:
-        with Image.open(input_path) as img:
-            for base_size, scale in sizes:
-                output_size = (int(base_size * scale), int(base_size * scale))
-                icon_img = img.resize(output_size, Image.LANCZOS)
-                filename = f"icon_{base_size}x{base_size}@{scale}x.png".replace('.5', 'p5')
-                output_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-                icon_img.save(output_path, format='PNG')
-                icon_paths.append(output_path)
+        targets = icon_targets(platforms)
+        # Each icon set gets its own directory so cached sets are not overwritten.
+        output_dir = output_path_for(f"icons_{uuid.uuid4().hex}", create=True)
+        os.makedirs(output_dir)
+        with open_for_downscale(source, ICON_MASTER_SIZE) as img:
+            decode(img)
+            for names, data in iter_app_icons(img, targets):
+                for name in names:
+                    path = os.path.join(output_dir, name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'wb') as f:
+                        f.write(data)
+        return [os.path.join(output_dir, name) for _, _, name in targets]
     except Exception as e:
-        logger.error(f"Error generating iOS app icons: {e}")
+        logger.error(f"Error generating app icons for {platforms}: {e}")
         return None
-    return icon_paths
 
-def create_homescreen_mockup(icon_path):
-    mockup_path = os.path.join('static', 'mockups', 'homescreen_mockup.png')
-    if not os.path.exists(mockup_path):
-        logger.error("Homescreen mockup base image not found.")
-        return None
+MOCKUP_PATH = os.path.join('static', 'mockups', 'homescreen_mockup.png')
+MOCKUP_ICON_NAME = icon_filename(60, 3)
+FRAME_PATH = os.path.join('static', 'frames', 'iphone_frame.png')
+LAUNCH_BACKGROUND_PATH = os.path.join('static', 'backgrounds', 'launch_background.png')
 
+class AssetCache:
+    """
+    Decoded template images keyed by path. Each image is decoded once and
+    reloaded only when the file's mtime changes. The cached images are never
+    handed out; callers get a copy to composite onto.
+    """
+    def __init__(self):
+        self.images = {}  # path -> (mtime_ns, image)
+        self.lock = threading.Lock()
+
+    def peek(self, path):
+        """
+        Return the shared decoded image at path, or None if it does not exist.
+        Callers may read (crop) it but must never modify it.
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            entry = self.images.get(path)
+            if entry is None or entry[0] != mtime:
+                with Image.open(path) as img:
+                    img.load()
+                entry = (mtime, img)
+                self.images[path] = entry
+        return entry[1]
+
+    def get(self, path):
+        """Return a copy of the decoded image at path, or None if it does not exist."""
+        img = self.peek(path)
+        return img.copy() if img is not None else None
+
+    def preload(self, paths):
+        for path in paths:
+            try:
+                self.get(path)
+            except Exception as e:
+                logger.warning(f"Could not preload asset '{path}': {e}")
+
+asset_cache = AssetCache()
+asset_cache.preload([MOCKUP_PATH, FRAME_PATH, LAUNCH_BACKGROUND_PATH])
+
+def layer_image(img):
+    """Normalize a layer to RGB (pasted opaque) or RGBA (alpha composited)."""
+    if img.mode in ('RGB', 'RGBA'):
+        return img
+    return img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+def composite_strips(size, layers, background=(0, 0, 0, 0)):
+    """
+    Yield RGBA strips of COMPOSITE_TILE_ROWS rows covering a canvas of size,
+    each with every (image, (x, y)) layer composited in order. Layers are
+    only cropped, never copied whole, and one strip is alive at a time, so
+    memory stays flat however large the canvas is.
+    """
+    width, height = size
+    rows = app.config['COMPOSITE_TILE_ROWS']
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        with timed_stage('composite'):
+            strip = Image.new('RGBA', (width, bottom - top), background)
+            for img, (x, y) in layers:
+                box = (max(x, 0), max(y, top), min(x + img.width, width), min(y + img.height, bottom))
+                if box[0] >= box[2] or box[1] >= box[3]:
+                    continue
+                region = img.crop((box[0] - x, box[1] - y, box[2] - x, box[3] - y))
+                if region.mode == 'RGBA':
+                    strip.alpha_composite(region, (box[0], box[1] - top))
+                else:
+                    strip.paste(region, (box[0], box[1] - top))
+        yield strip
+
+def png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+def write_png_strips(fp, size, strips, compress_level=6):
+    """
+    Write RGBA strips as a single PNG without assembling the image. Every
+    row uses the Up filter, computed for a whole strip at once by
+    subtracting the strip shifted down one row (modulo 256).
+    """
+    width, height = size
+    stride = width * 4
+    fp.write(b'\x89PNG\r\n\x1a\n')
+    fp.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+    compressor = zlib.compressobj(compress_level)
+    previous_row = Image.new('RGBA', (width, 1))
+    for strip in strips:
+        with timed_stage('encode'):
+            above = Image.new('RGBA', strip.size)
+            above.paste(previous_row, (0, 0))
+            above.paste(strip.crop((0, 0, width, strip.height - 1)), (0, 1))
+            previous_row = strip.crop((0, strip.height - 1, width, strip.height))
+            filtered = ImageChops.subtract_modulo(strip, above).tobytes()
+            data = compressor.compress(b''.join(b'\x02' + filtered[i:i + stride]
+                                                for i in range(0, len(filtered), stride)))
+            if data:
+                fp.write(png_chunk(b'IDAT', data))
+    fp.write(png_chunk(b'IDAT', compressor.flush()))
+    fp.write(png_chunk(b'IEND', b''))
+
+def composite_output(size, layers, prefix, profile=None):
+    """
+    Composite layers onto a transparent canvas of size in one tiled pass and
+    save it as a new output. PNG profiles stream strip by strip; other
+    formats need the whole canvas for their encoder.
+    """
+    fmt, options = ENCODE_PROFILES[profile or app.config['OUTPUT_PROFILE']]
+    if fmt != 'PNG':
+        canvas = Image.new('RGBA', size)
+        top = 0
+        for strip in composite_strips(size, layers):
+            canvas.paste(strip, (0, top))
+            top += strip.height
+        return save_output(canvas, prefix, profile)
+    output_path = new_output_path(prefix, OUTPUT_FORMATS['PNG'][0])
+    with open(output_path, 'wb') as f:
+        write_png_strips(f, size, composite_strips(size, layers),
+                         options.get('compress_level', 9 if options.get('optimize') else 6))
+    return output_path
+
+def create_homescreen_mockup(icon_path):
     try:
-        with Image.open(mockup_path) as bg:
-            with Image.open(icon_path) as icon:
-                icon = icon.resize((180, 180), Image.LANCZOS)
-                bg.paste(icon, (100, 300), icon)
-                output_path = os.path.join(app.config['OUTPUT_FOLDER'], unique_filename('homescreen'))
-                bg.save(output_path, format='PNG')
-        return output_path
+        bg = asset_cache.peek(MOCKUP_PATH)
+        if bg is None:
+            logger.error("Homescreen mockup base image not found.")
+            return None
+
+        with open_for_downscale(icon_path, (180, 180)) as icon:
+            icon = downscale(decode(icon), (180, 180))
+        layers = [(layer_image(bg), (0, 0)), (ensure_mode(icon, 'RGBA'), (100, 300))]
+        return composite_output(bg.size, layers, 'homescreen')
     except Exception as e:
         logger.error(f"Error creating homescreen mockup: {e}")
         return None
 
-def overlay_frame(input_path):
-    frame_path = os.path.join('static', 'frames', 'iphone_frame.png')
-    if not os.path.exists(frame_path):
+# Screen area inside FRAME_PATH as (x, y, width, height), and the margin between framed devices.
+FRAME_DISPLAY_BOX = (200, 300, 600, 1300)
+FRAME_GAP = 100
+
+def compose_frames(sources):
+    """
+    Place each screenshot in its own copy of the device frame, side by side
+    on one canvas. A single screenshot yields exactly the frame's size.
+    """
+    frame = asset_cache.peek(FRAME_PATH)
+    if frame is None:
         logger.error("Frame image not found.")
         return None
+    frame = layer_image(frame)
+
+    display_x, display_y, display_w, display_h = FRAME_DISPLAY_BOX
+    gap = FRAME_GAP if len(sources) > 1 else 0
+    size = (len(sources) * (frame.width + gap) + gap, frame.height + 2 * gap)
+    layers = []
+    for i, source in enumerate(sources):
+        x = gap + i * (frame.width + gap)
+        with open_for_downscale(source, (display_w, display_h)) as img:
+            screenshot = layer_image(downscale(decode(img), (display_w, display_h)))
+        layers.append((frame, (x, gap)))
+        layers.append((screenshot, (x + display_x, gap + display_y)))
+    return composite_output(size, layers, 'framed')
 
+@memory_budgeted('frame')
+def overlay_frame(source):
     try:
-        with Image.open(frame_path) as frame:
-            with Image.open(input_path) as img:
-                display_x, display_y = 200, 300
-                display_w, display_h = 600, 1300
-                screenshot = img.resize((display_w, display_h), Image.LANCZOS)
-                frame.paste(screenshot, (display_x, display_y))
-                output_path = os.path.join(app.config['OUTPUT_FOLDER'], unique_filename('framed'))
-                frame.save(output_path, 'PNG')
-        return output_path
+        return compose_frames([source])
     except Exception as e:
         logger.error(f"Error overlaying frame: {e}")
         return None
 
-def convert_color_profile(input_path):
+def overlay_frames(sources):
+    """Frame several screenshots on one canvas, reserving the budget for all of them."""
+    with memory_budget.reserve(sum(estimate_working_set(source, 'frame') for source in sources)):
+        try:
+            return compose_frames(sources)
+        except Exception as e:
+            logger.error(f"Error overlaying frames: {e}")
+            return None
+
+@cached_result('srgb')
+@memory_budgeted('srgb')
+def convert_color_profile(source, profile=None):
     try:
-        with Image.open(input_path) as img:
-            img = img.convert('RGB')
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], unique_filename('srgb'))
-            img.save(output_path, format='PNG')
+        with Image.open(source) as img:
+            img = decode(img).convert('RGB')
+            output_path = save_output(img, 'srgb', profile)
         return output_path
     except Exception as e:
         logger.error(f"Error converting color profile: {e}")
         return None
 
-def generate_launch_screen(input_path):
-    bg_path = os.path.join('static', 'backgrounds', 'launch_background.png')
-    if not os.path.exists(bg_path):
-        logger.error("Launch background not found.")
-        return None
-
+@memory_budgeted('launch_screen')
+def generate_launch_screen(source):
     try:
-        with Image.open(bg_path) as bg:
-            with Image.open(input_path) as fg:
-                bg_w, bg_h = bg.size
-                fg = fg.resize((int(bg_w*0.5), int(bg_h*0.5)), Image.LANCZOS)
-                fg_w, fg_h = fg.size
-                offset = ((bg_w - fg_w)//2, (bg_h - fg_h)//2)
-                bg.paste(fg, offset, fg if fg.mode == 'RGBA' else None)
-                output_path = os.path.join(app.config['OUTPUT_FOLDER'], unique_filename('launchscreen'))
-                bg.save(output_path, 'PNG')
-        return output_path
+        bg = asset_cache.peek(LAUNCH_BACKGROUND_PATH)
+        if bg is None:
+            logger.error("Launch background not found.")
+            return None
+
+        bg_w, bg_h = bg.size
+        fg_size = (int(bg_w*0.5), int(bg_h*0.5))
+        with open_for_downscale(source, fg_size) as fg:
+            fg = layer_image(downscale(decode(fg), fg_size))
+        fg_w, fg_h = fg.size
+        offset = ((bg_w - fg_w)//2, (bg_h - fg_h)//2)
+        return composite_output(bg.size, [(layer_image(bg), (0, 0)), (fg, offset)], 'launchscreen')
     except Exception as e:
         logger.error(f"Error generating launch screen: {e}")
         return None
 
+FONT_PATH = os.path.join('static', 'fonts', 'SanFrancisco.ttf')
+
+@functools.lru_cache(maxsize=app.config['FONT_CACHE_SIZE'])
+def load_font(font_path, font_size):
+    """Load a TrueType font once per (path, size) instead of reparsing it per request."""
+    return ImageFont.truetype(font_path, font_size)
+
 def generate_typography_preview(text="Hello, iOS!", font_size=72):
-    font_path = os.path.join('static', 'fonts', 'SanFrancisco.ttf')
-    if not os.path.exists(font_path):
+    if not os.path.exists(FONT_PATH):
         logger.error("Font file not found for typography preview.")
         return None
 
     try:
+        # Previews depend only on the text and size, so reuse earlier renders.
+        key = result_cache.make_key(None, 'typography', (FONT_PATH, text, font_size))
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+
         img = Image.new('RGBA', (1200, 200), (255,255,255,0))
         draw = ImageDraw.Draw(img)
-        font = ImageFont.truetype(font_path, font_size)
-        text_w, text_h = draw.textsize(text, font=font)
-        draw.text(((1200-text_w)//2, (200-text_h)//2), text, font=font, fill=(0,0,0,255))
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], unique_filename('typography'))
-        img.save(output_path, 'PNG')
+        font = load_font(FONT_PATH, font_size)
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        text_w, text_h = right - left, bottom - top
+        draw.text(((1200-text_w)//2 - left, (200-text_h)//2 - top), text, font=font, fill=(0,0,0,255))
+        output_path = save_output(img, 'typography')
+        result_cache.put(key, output_path)
         return output_path
     except Exception as e:
         logger.error(f"Error generating typography preview: {e}")
         return None
 
+# Operations that can run in background job mode, by job op name.
+JOB_OPERATIONS = {
+    'icon_set': generate_app_icons,
+    'convert': convert_image,
+    'filters': apply_filter_pipeline,
+    'frame': overlay_frame,
+    'srgb': convert_color_profile,
+    'launch_screen': generate_launch_screen,
+}
+
 def zip_files(file_paths, zip_name='assets.zip'):
-    zip_path = os.path.join(app.config['OUTPUT_FOLDER'], zip_name)
+    zip_path = output_path_for(zip_name, create=True)
     try:
-        with zipfile.ZipFile(zip_path, 'w') as zf:
+        # Entries keep their folders relative to the directory the files share.
+        base_dir = os.path.commonpath([os.path.dirname(fp) for fp in file_paths]) if file_paths else ''
+        # PNGs are already deflated; storing them avoids a pointless recompression pass.
+        with timed_stage('zip'), zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_STORED) as zf:
             for fp in file_paths:
-                zf.write(fp, os.path.basename(fp))
+                zf.write(fp, os.path.relpath(fp, base_dir))
         return zip_path
     except Exception as e:
         logger.error(f"Error creating zip file: {e}")
         return None
 
+class ZipStreamSink(io.RawIOBase):
+    """Write-only, non-seekable sink that collects ZipFile output for streaming."""
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_app_icons_zip(icons, close):
+    """
+    Generator yielding a ZIP of the (names, data) icons from iter_app_icons
+    as each one is encoded. Nothing touches the disk; entries are stored
+    without recompression. Calls close() when done. Failures propagate so the
+    server aborts the response instead of finishing a truncated archive.
+    """
+    sink = ZipStreamSink()
+    try:
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zf:
+            for names, data in icons:
+                with timed_stage('zip'):
+                    for name in names:
+                        zf.writestr(name, data)
+                yield sink.drain()
+        yield sink.drain()
+    except Exception as e:
+        logger.error(f"Error streaming app icon zip: {e}")
+        raise
+    finally:
+        close()
+
+def send_no_cache_stream(chunks, download_name, mimetype):
+    """
+    Streamed counterpart of send_no_cache_file for generated downloads.
+    """
+    resp = Response(chunks, mimetype=mimetype)
+    resp.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    resp.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    resp.headers['Pragma'] = 'no-cache'
+    resp.headers['Expires'] = '0'
+    return resp
+
 def send_no_cache_file(path, **kwargs):
     """
     Wrapper for send_file that adds no-cache headers.
@@ -252,6 +1271,665 @@ def send_no_cache_file(path, **kwargs):
     resp.headers['Expires'] = '0'
     return resp
 
+@functools.lru_cache(maxsize=4096)
+def content_etag(path, mtime_ns, size):
+    """Strong ETag from the file's SHA-256; memoized per (path, mtime, size)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def send_immutable_file(path, **kwargs):
+    """
+    Wrapper for send_file for outputs that never change once written. Sends a
+    content-hash ETag and a long immutable Cache-Control; send_file's
+    conditional handling answers If-None-Match with 304 and serves byte ranges.
+    """
+    st = os.stat(path)
+    etag = content_etag(path, st.st_mtime_ns, st.st_size)
+    resp = send_file(path, etag=etag, conditional=True,
+                     max_age=app.config['IMMUTABLE_MAX_AGE'], **kwargs)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+def send_output_file(path, **kwargs):
+    """Send a generated output using the configured download caching mode."""
+    if app.config['IMMUTABLE_DOWNLOADS']:
+        return send_immutable_file(path, **kwargs)
+    return send_no_cache_file(path, **kwargs)
+
+@cached_result('encode')
+@memory_budgeted('encode')
+def encode_output(source, profile):
+    """Re-encode a stored output with profile. Returns the new path, or None."""
+    try:
+        with Image.open(source) as img:
+            return save_output(decode(img), 'encoded', profile)
+    except Exception as e:
+        logger.error(f"Error encoding output as '{profile}': {e}")
+        return None
+
+# Alternate download formats: name -> (encode profile, MIME type).
+ALTERNATE_FORMATS = {
+    'webp': ('webp', 'image/webp'),
+    'jpeg': ('jpeg', 'image/jpeg'),
+    'jpg': ('jpeg', 'image/jpeg'),
+}
+
+def download_profile():
+    """
+    Encode profile for the current download: an explicit ?format=, else the
+    format the Accept header prefers among NEGOTIATE_FORMATS, else
+    DOWNLOAD_PROFILE. PNG wins ties, so only clients that ask get WebP/JPEG.
+    """
+    fmt = request.args.get('format', '').lower()
+    if fmt not in ALTERNATE_FORMATS and fmt != 'png' and app.config['NEGOTIATE_FORMATS']:
+        offered = {ALTERNATE_FORMATS[f][1]: f for f in app.config['NEGOTIATE_FORMATS'] if f in ALTERNATE_FORMATS}
+        fmt = offered.get(request.accept_mimetypes.best_match(['image/png', *offered]))
+    if fmt in ALTERNATE_FORMATS:
+        return ALTERNATE_FORMATS[fmt][0]
+    return app.config['DOWNLOAD_PROFILE']
+
+def send_download(path, download_name=None, stored_profile=None):
+    """
+    Send an image output as an attachment encoded with download_profile().
+    Outputs stored with another profile (default OUTPUT_PROFILE) are
+    re-encoded once and cached; the original is sent if that fails.
+    """
+    profile = download_profile()
+    if profile != (stored_profile or app.config['OUTPUT_PROFILE']):
+        path = encode_output(path, profile) or path
+    ext = os.path.splitext(path)[1]
+    mimetype = next((mime for e, mime in OUTPUT_FORMATS.values() if '.' + e == ext), None)
+    stem = os.path.splitext(download_name or os.path.basename(path))[0]
+    resp = send_output_file(path, as_attachment=True, mimetype=mimetype, download_name=stem + ext)
+    if app.config['NEGOTIATE_FORMATS']:
+        resp.vary.add('Accept')
+    return resp
+
+class OutputJanitor:
+    """
+    Background thread enforcing retention on the output and upload folders.
+    Each sweep removes files older than ttl, then the oldest remaining files
+    until the total is under max_bytes, and keeps running totals of what
+    was reclaimed.
+    """
+    def __init__(self, folders, ttl, max_bytes, interval):
+        self.folders = folders
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.files_reclaimed = 0
+        self.bytes_reclaimed = 0
+        self.sweeps = 0
+        self.last_sweep = None
+        self.current_files = None
+        self.current_bytes = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def sweep(self):
+        now = time.time()
+        files = []
+        for folder in self.folders:
+            for root, _, names in os.walk(folder):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path, folder))
+        files.sort()
+
+        total = sum(f[1] for f in files)
+        reclaimed_files = reclaimed_bytes = 0
+        for mtime, size, path, folder in files:
+            if mtime >= now - self.ttl and total <= self.max_bytes:
+                break
+            if self._remove(path, folder):
+                total -= size
+                reclaimed_files += 1
+                reclaimed_bytes += size
+
+        if reclaimed_files:
+            result_cache.prune()
+            logger.info(f"Janitor reclaimed {reclaimed_files} files ({reclaimed_bytes} bytes).")
+        with self.lock:
+            self.files_reclaimed += reclaimed_files
+            self.bytes_reclaimed += reclaimed_bytes
+            self.sweeps += 1
+            self.last_sweep = now
+            self.current_files = len(files) - reclaimed_files
+            self.current_bytes = total
+
+    @staticmethod
+    def _remove(path, folder):
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        # Drop emptied per-result directories (icon sets), but keep shard directories.
+        remove_empty_parents(path, folder)
+        return True
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Janitor sweep failed: {e}")
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='output-janitor', daemon=True)
+            self.thread.start()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'sweeps': self.sweeps,
+                'last_sweep': self.last_sweep,
+                'files_reclaimed': self.files_reclaimed,
+                'bytes_reclaimed': self.bytes_reclaimed,
+                'files': self.current_files,
+                'bytes': self.current_bytes,
+            }
+
+janitor = OutputJanitor([app.config['OUTPUT_FOLDER'], app.config['UPLOAD_FOLDER']],
+                        app.config['OUTPUT_TTL_SECONDS'], app.config['OUTPUT_MAX_BYTES'],
+                        app.config['JANITOR_INTERVAL_SECONDS'])
+# Job worker processes import this module as __mp_main__; only the serving process sweeps.
+if os.environ.get('JANITOR_ENABLED', '1') == '1' and __name__ != '__mp_main__':
+    janitor.start()
+
+# Job workers are started fresh (forkserver or spawn) rather than forked from
+# this multithreaded process, so every lock they use (metrics, profile_lock,
+# the caches, the memory budget) is created in the worker and none can be
+# inherited mid-acquire. In exchange they import this module themselves. Run as
+# a script it arrives as __mp_main__; loaded from its file path under another
+# name it cannot be imported by name, so this bootstrap, run with exec() as the
+# pool initializer, loads it the same way before any job that refers to it is
+# unpickled. It then applies the serving process's configuration.
+JOB_WORKER_BOOTSTRAP = """
+import importlib.util, os, sys
+if name not in sys.modules:
+    os.environ['JANITOR_ENABLED'] = '0'
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+sys.modules[name].configure_job_worker(config, assets)
+"""
+
+# Template asset paths, which may be repointed after import (xcode_bench.py does).
+ASSET_PATH_NAMES = ('MOCKUP_PATH', 'FRAME_PATH', 'LAUNCH_BACKGROUND_PATH')
+
+def configure_job_worker(config, assets):
+    """Adopt the serving process's app.config and asset paths, including changes made after import."""
+    app.config.update(config)
+    globals().update(assets)
+    Image.MAX_IMAGE_PIXELS = app.config['MAX_IMAGE_PIXELS']
+
+def run_job(op, data, args):
+    """Process-pool entry point: run a heavy operation on uploaded image bytes."""
+    fn = JOB_OPERATIONS[op]
+    # The parent process owns the result cache; skip only that layer, never the memory budget.
+    fn = getattr(fn, 'uncached', fn)
+    return fn(io.BytesIO(data), *args)
+
+class JobQueue:
+    """
+    Runs heavy operations on a local process pool so request threads stay
+    free. At most max_pending jobs and batch runs may be unfinished at once;
+    submit returns None beyond that so callers can push back on the client,
+    and run waits for room.
+    """
+    def __init__(self, max_workers, max_pending, max_records=1000):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_records = max_records
+        self.executor = None
+        self.jobs = OrderedDict()  # job_id -> {'future', 'output'}
+        self.running = set()  # unfinished futures from the pool
+        # Reentrant: a future's done-callbacks run in the submitting thread if it is already done.
+        self.lock = threading.RLock()
+        self.slot_freed = threading.Condition(self.lock)
+
+    def _get_executor(self):
+        if self.executor is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            bootstrap = {'name': __name__, 'path': os.path.abspath(__file__), 'config': dict(app.config),
+                         'assets': {name: globals()[name] for name in ASSET_PATH_NAMES}}
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                mp_context=multiprocessing.get_context(method),
+                                                initializer=exec, initargs=(JOB_WORKER_BOOTSTRAP, bootstrap))
+        return self.executor
+
+    def pending(self):
+        with self.lock:
+            return self._pending()
+
+    def _pending(self):
+        return len(self.running)
+
+    def submit(self, op, source, *args):
+        """Queue op on the uploaded source and return a job ID, or None if the queue is full."""
+        future = self.cached_future(op, source, *args)
+        if future is not None:
+            with self.lock:
+                return self._add(future)
+        key, data = self._prepare(op, source, args)
+        # Check the depth and record the job together, so concurrent submits cannot overshoot it.
+        with self.lock:
+            if self._pending() >= self.max_pending:
+                return None
+            return self._add(self._start(op, data, args, key))
+
+    @staticmethod
+    def cached_future(op, source, *args):
+        """Completed future holding the cached result of op on source, or None."""
+        fn = JOB_OPERATIONS[op]
+        if not hasattr(fn, 'cache_key'):
+            return None
+        cached = result_cache.get(fn.cache_key(source, *args))
+        if cached is None:
+            return None
+        future = Future()
+        future.set_result(cached)
+        return future
+
+    def run(self, op, source, *args, timeout=None):
+        """
+        Run op on source in the process pool and return its future, without a
+        job record. Waits up to timeout seconds (None: indefinitely) for the
+        queue to have room and returns None if it does not. Successful results
+        are cached.
+        """
+        key, data = self._prepare(op, source, args)
+        with self.lock:
+            if not self.slot_freed.wait_for(lambda: self._pending() < self.max_pending, timeout):
+                return None
+            return self._start(op, data, args, key)
+
+    @staticmethod
+    def _prepare(op, source, args):
+        """Cache key (or None) and input bytes for running op on source."""
+        fn = JOB_OPERATIONS[op]
+        key = fn.cache_key(source, *args) if hasattr(fn, 'cache_key') else None
+        source.seek(0)
+        return key, source.read()
+
+    def _start(self, op, data, args, key):
+        # Caller holds self.lock.
+        try:
+            future = self._get_executor().submit(run_job, op, data, args)
+        except BrokenProcessPool:
+            logger.error("Job process pool was broken; starting a new one.")
+            self.executor = None
+            future = self._get_executor().submit(run_job, op, data, args)
+        self.running.add(future)
+        future.add_done_callback(self._finished)
+        if key is not None:
+            future.add_done_callback(lambda f: self._cache_result(key, f))
+        return future
+
+    def _finished(self, future):
+        with self.lock:
+            self.running.discard(future)
+            self.slot_freed.notify_all()
+
+    @staticmethod
+    def _cache_result(key, future):
+        if future.exception() is None and future.result():
+            result_cache.put(key, future.result())
+
+    def _add(self, future):
+        # Caller holds self.lock.
+        job_id = uuid.uuid4().hex
+        self.jobs[job_id] = {'future': future, 'output': None}
+        # Forget the oldest finished jobs once the table is full.
+        for old_id in list(self.jobs):
+            if len(self.jobs) <= self.max_records:
+                break
+            if self.jobs[old_id]['future'].done():
+                del self.jobs[old_id]
+        future.add_done_callback(lambda f: self._log_failure(job_id, f))
+        return job_id
+
+    @staticmethod
+    def _log_failure(job_id, future):
+        if future.exception() is not None:
+            logger.error(f"Job {job_id} failed: {future.exception()}")
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        future = job['future']
+        if not future.done():
+            return 'running' if future.running() else 'queued'
+        if future.exception() is not None:
+            return 'failed'
+        return 'done' if future.result() else 'failed'
+
+    def output_path(self, job_id):
+        """Path of the finished job's output, zipping multi-file results on first request."""
+        if self.status(job_id) != 'done':
+            return None
+        with self.lock:
+            job = self.jobs[job_id]
+            if job['output'] is None:
+                result = job['future'].result()
+                if isinstance(result, str):
+                    job['output'] = result
+                else:
+                    job['output'] = zip_files(result, unique_filename('job', 'zip'))
+            return job['output']
+
+job_queue = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_QUEUE_DEPTH'])
+
+def wants_job():
+    """True when the client asked for the background job mode (async=1)."""
+    return request.form.get('async', '').lower() in ('1', 'true', 'on')
+
+def queue_full_response():
+    resp = make_response(jsonify(error="Job queue is full. Please retry later."), 503)
+    resp.headers['Retry-After'] = '5'
+    return resp
+
+def submit_job_response(op, source, *args):
+    job_id = job_queue.submit(op, source, *args)
+    if job_id is None:
+        return queue_full_response()
+    return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id)), 202
+
+def parse_batch_operation(form):
+    """
+    Turn the batch form fields into (op, args) for JOB_OPERATIONS.
+    Raises ValueError for unknown operations or malformed parameters.
+    """
+    op = form.get('operation', 'convert')
+    if op == 'convert':
+        width, _, height = form.get('size', '1024x1024').lower().partition('x')
+        width, height = int(width), int(height or width)
+        if width <= 0 or height <= 0:
+            raise ValueError(f"Size {width}x{height} must be positive.")
+        if width * height > app.config['MAX_IMAGE_PIXELS']:
+            raise ValueError(f"Size {width}x{height} is over the limit of {app.config['MAX_IMAGE_PIXELS']} pixels.")
+        return op, ((width, height),)
+    if op == 'filters':
+        pipeline = form.get('filter_pipeline', '')
+        return op, ([f.strip() for f in pipeline.split(',') if f.strip()],)
+    if op in ('frame', 'srgb', 'launch_screen'):
+        return op, ()
+    raise ValueError(f"Unsupported batch operation '{op}'.")
+
+def detach_upload(file):
+    """
+    Take ownership of an upload's stream so it outlives the request, which
+    closes its files on teardown even while a response is still streaming.
+    The caller must close the returned stream.
+    """
+    stream = upload_source(file)
+    file.stream = io.BytesIO()
+    return stream
+
+def iter_batch_sources(uploads, archive=None, errors=None):
+    """
+    Yield (name, stream) for each detached (name, stream) upload, then for
+    every entry of the optional archive ZIP stream. Archive entries beyond
+    BATCH_MAX_ENTRY_BYTES are skipped, and the archive is abandoned once its
+    entries add up to BATCH_MAX_TOTAL_BYTES; both are reported in errors.
+    Closes all streams when done.
+    """
+    max_entry = app.config['BATCH_MAX_ENTRY_BYTES']
+    max_total = app.config['BATCH_MAX_TOTAL_BYTES']
+    errors = [] if errors is None else errors
+    try:
+        yield from uploads
+        if archive is not None:
+            total = 0
+            with zipfile.ZipFile(archive) as zf:
+                for info in zf.infolist():
+                    if info.is_dir():
+                        continue
+                    # zipfile never inflates an entry past its declared file_size, so checking it is enough.
+                    if info.file_size > max_entry:
+                        errors.append(f"{info.filename}: larger than {max_entry} bytes uncompressed")
+                        continue
+                    total += info.file_size
+                    if total > max_total:
+                        errors.append(f"{info.filename}: archive exceeds {max_total} bytes uncompressed; "
+                                      f"remaining entries skipped")
+                        return
+                    yield info.filename, io.BytesIO(zf.read(info))
+    finally:
+        close_batch_sources(uploads, archive)
+
+def close_batch_sources(uploads, archive=None):
+    for _, stream in uploads:
+        stream.close()
+    if archive is not None:
+        archive.close()
+
+def stream_batch_zip(op, args, sources, errors=None):
+    """
+    Generator running op over sources on the job process pool and yielding a
+    ZIP of the outputs as each one finishes. A sliding window of submissions
+    keeps memory bounded, and each one waits for room in the job queue.
+    Failed files, including any already in errors, are listed in errors.txt;
+    other failures propagate so the server aborts the response instead of
+    finishing a truncated archive.
+    """
+    sink = ZipStreamSink()
+    window = 2 * job_queue.max_workers
+    pending = {}
+    used_names = set()
+    errors = [] if errors is None else errors
+
+    def submit_next():
+        for count, (name, source) in enumerate(sources, 1):
+            if count > app.config['BATCH_MAX_FILES']:
+                errors.append(f"{name}: batch limit of {app.config['BATCH_MAX_FILES']} files reached")
+                return
+            future = (job_queue.cached_future(op, source, *args)
+                      or job_queue.run(op, source, *args, timeout=app.config['BATCH_QUEUE_WAIT_SECONDS']))
+            if future is None:
+                errors.append(f"{name}: job queue stayed full")
+                continue
+            pending[future] = name
+            if len(pending) >= window:
+                yield
+
+    try:
+        feeder = submit_next()
+        next(feeder, None)
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as zf:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    result = future.result() if future.exception() is None else None
+                    if not result:
+                        errors.append(f"{name}: {future.exception() or 'processing failed'}")
+                        continue
+                    stem = os.path.splitext(secure_filename(os.path.basename(name)) or 'image')[0]
+                    ext = os.path.splitext(result)[1]
+                    arcname = f"{stem}{ext}"
+                    counter = 1
+                    while arcname in used_names:
+                        counter += 1
+                        arcname = f"{stem}_{counter}{ext}"
+                    used_names.add(arcname)
+                    with timed_stage('zip'):
+                        zf.write(result, arcname)
+                yield sink.drain()
+                next(feeder, None)
+            if errors:
+                zf.writestr('errors.txt', '\n'.join(errors) + '\n')
+        yield sink.drain()
+    except Exception as e:
+        logger.error(f"Error streaming batch '{op}': {e}")
+        raise
+    finally:
+        sources.close()
+
+def peak_rss_kb():
+    """Process peak resident set size in KB, or None where unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere.
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+@app.before_request
+def record_memory_baseline():
+    g.peak_rss_start = peak_rss_kb()
+
+@app.after_request
+def report_memory(resp):
+    """
+    Report memory use per request: the process peak RSS, how much this request
+    raised it, and the pixel bytes decoded. Concurrent requests share the
+    process peak, so the growth figure is an upper bound under load.
+    """
+    peak = peak_rss_kb()
+    if peak is not None:
+        resp.headers['X-Peak-RSS-KB'] = str(peak)
+        resp.headers['X-Peak-RSS-Growth-KB'] = str(peak - (g.get('peak_rss_start') or peak))
+    resp.headers['X-Decoded-Bytes'] = str(g.get('decoded_bytes', 0))
+    return resp
+
+def current_rss_bytes():
+    """Current resident set size in bytes, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def request_route():
+    """Route pattern of the current request, used as a low-cardinality metric label."""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def count_response_bytes(chunks, route):
+    """Pass a streamed body through, counting its bytes once it finishes or is closed."""
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.inc('xcode_response_bytes_total', sent, route=route)
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+# cProfile allows one active profiler per process, so sampled requests take turns.
+profile_lock = threading.Lock()
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    if request.content_length:
+        metrics.inc('xcode_request_bytes_total', request.content_length, route=request_route())
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate and profile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+    if request.mimetype == 'multipart/form-data':
+        # Parse the upload here so spooling it is timed apart from the handler.
+        with timed_stage('upload'):
+            request.files
+
+@app.after_request
+def record_request_metrics(resp):
+    """
+    Count response bytes and observe request latency per route. Streamed
+    bodies are measured when they finish, so the latency covers the stream.
+    """
+    route, method, status = request_route(), request.method, str(resp.status_code)
+    start = g.get('request_start', time.perf_counter())
+    if resp.content_length is not None:
+        if method != 'HEAD':
+            metrics.inc('xcode_response_bytes_total', resp.content_length, route=route)
+    elif resp.is_streamed:
+        resp.response = count_response_bytes(resp.response, route)
+    resp.call_on_close(lambda: metrics.observe('xcode_request_duration_seconds', time.perf_counter() - start,
+                                               route=route, method=method, status=status))
+    return resp
+
+@app.teardown_request
+def finish_request_profile(exc):
+    """Stop a sampled profile and report it if the request was slow."""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    profiler.disable()
+    profile_lock.release()
+    elapsed = time.perf_counter() - g.request_start
+    if elapsed < app.config['PROFILE_SLOW_SECONDS']:
+        return
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(20)
+    logger.warning(f"Slow request {request.method} {request.path} took {elapsed:.3f}s:\n{out.getvalue()}")
+    folder = app.config['PROFILE_FOLDER']
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+        profiler.dump_stats(os.path.join(folder, unique_filename('profile', 'prof')))
+
+def metrics_samples():
+    """Scrape-time counters and gauges read from the caches, queues and process."""
+    cache = result_cache.stats()
+    lookups = cache['hits'] + cache['misses']
+    budget = memory_budget.stats()
+    outputs = janitor.stats()
+    peak_kb = peak_rss_kb()
+    return [
+        ('xcode_result_cache_hits_total', 'counter', 'Result cache hits.', {}, cache['hits']),
+        ('xcode_result_cache_misses_total', 'counter', 'Result cache misses.', {}, cache['misses']),
+        ('xcode_result_cache_hit_ratio', 'gauge', 'Fraction of result cache lookups that hit.', {},
+         cache['hits'] / lookups if lookups else None),
+        ('xcode_result_cache_entries', 'gauge', 'Entries in the result cache.', {}, cache['entries']),
+        ('xcode_result_cache_bytes', 'gauge', 'Bytes of artifacts held by the result cache.', {}, cache['bytes']),
+        ('xcode_job_queue_depth', 'gauge', 'Background jobs queued or running.', {}, job_queue.pending()),
+        ('xcode_job_queue_capacity', 'gauge', 'Most background jobs allowed in flight.', {}, job_queue.max_pending),
+        ('xcode_memory_budget_in_use_bytes', 'gauge', 'Estimated working set reserved by running operations.', {},
+         budget['in_use']),
+        ('xcode_memory_budget_limit_bytes', 'gauge', 'Per-process memory budget.', {}, budget['limit']),
+        ('xcode_memory_budget_admitted_total', 'counter', 'Operations admitted by the memory budget.', {},
+         budget['admitted']),
+        ('xcode_memory_budget_queued_total', 'counter', 'Operations that waited for the memory budget.', {},
+         budget['queued']),
+        ('xcode_memory_budget_rejected_total', 'counter', 'Operations rejected by the memory budget.', {},
+         budget['rejected']),
+        ('xcode_output_files', 'gauge', 'Files on disk at the last janitor sweep.', {}, outputs['files']),
+        ('xcode_output_bytes', 'gauge', 'Bytes on disk at the last janitor sweep.', {}, outputs['bytes']),
+        ('xcode_janitor_reclaimed_bytes_total', 'counter', 'Bytes removed by the janitor.', {},
+         outputs['bytes_reclaimed']),
+        ('xcode_janitor_reclaimed_files_total', 'counter', 'Files removed by the janitor.', {},
+         outputs['files_reclaimed']),
+        ('xcode_janitor_sweeps_total', 'counter', 'Janitor sweeps completed.', {}, outputs['sweeps']),
+        ('xcode_process_resident_memory_bytes', 'gauge', 'Resident set size of this worker.', {},
+         current_rss_bytes()),
+        ('xcode_process_peak_resident_memory_bytes', 'gauge', 'Peak resident set size of this worker.', {},
+         peak_kb * 1024 if peak_kb is not None else None),
+    ]
+
+@app.errorhandler(ImageTooLarge)
+def image_too_large(e):
+    flash(f"Image too large to process. {e}")
+    return redirect(url_for('index'))
+
+@app.errorhandler(MemoryBudgetExceeded)
+def memory_budget_exceeded(e):
+    flash(str(e))
+    return redirect(url_for('index'))
+
 @app.route('/xcode/', methods=['GET'])
 def index():
     # Main page (showing forms/tabs) 
@@ -275,11 +1953,9 @@ def upload_image():
 
         filename = secure_filename(file.filename)
         if filename:
-            input_filename = unique_filename('uploaded')
-            input_image_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-            file.save(input_image_path)
+            source = upload_source(file)
 
-            output_path = convert_image(input_image_path)
+            output_path = convert_image(source)
             if output_path:
                 return redirect(url_for('preview_image', filename=os.path.basename(output_path)))
             else:
@@ -293,17 +1969,16 @@ def upload_image():
 
 @app.route('/xcode/preview/<filename>')
 def preview_image(filename):
-    output_image_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-    if not os.path.exists(output_image_path):
+    if resolve_output(filename) is None:
         flash("The requested file does not exist.")
         return redirect(url_for('index'))
     return render_template('preview.html', filename=filename)
 
 @app.route('/xcode/download/<filename>')
 def download_image(filename):
-    output_image_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-    if os.path.exists(output_image_path):
-        return send_no_cache_file(output_image_path, mimetype='image/png', as_attachment=True)
+    output_image_path = resolve_output(filename)
+    if output_image_path:
+        return send_download(output_image_path, download_name=filename)
     else:
         flash("The requested file does not exist.")
         return redirect(url_for('index'))
@@ -319,20 +1994,60 @@ def generate_icon_set():
         flash("No file selected for icon set generation.")
         return redirect(url_for('index'))
 
+    # Comma-separated platforms from ICON_PLATFORMS, all produced from one decode.
+    try:
+        platforms = parse_platforms(request.form.get('platforms', 'ios'))
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('index'))
+    archive_name = 'ios_app_icons' if platforms == ('ios',) else 'app_icons'
+
     filename = secure_filename(file.filename)
     if filename:
-        input_filename = unique_filename('uploaded')
-        input_image_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-        file.save(input_image_path)
-        icon_paths = generate_ios_app_icons(input_image_path)
+        source = upload_source(file)
+
+        if wants_job():
+            return submit_job_response('icon_set', source, platforms)
+
+        # Stream mode sends the ZIP straight to the client with no files written.
+        if request.form.get('stream', '').lower() in ('1', 'true', 'on'):
+            # Releases the budget and closes the image and encoder once, whichever of
+            # the stream's end or the response's close comes first. A response closed
+            # before its first chunk never runs the generator's cleanup.
+            cleanup = contextlib.ExitStack()
+            try:
+                reserved = estimate_working_set(source, 'app_icons')
+                memory_budget.acquire(reserved)
+                cleanup.callback(memory_budget.release, reserved)
+                img = cleanup.enter_context(open_for_downscale(source, ICON_MASTER_SIZE))
+                decode(img)
+                icons = iter_app_icons(img, icon_targets(platforms))
+                cleanup.callback(icons.close)
+                # Encode the first icon before answering, so early failures can still redirect.
+                icons = itertools.chain([next(icons)], icons)
+            except Exception as e:
+                cleanup.close()
+                logger.error(f"Error generating app icons for {platforms}: {e}")
+                flash("Failed to generate icon set.")
+                return redirect(url_for('index'))
+            resp = send_no_cache_stream(stream_app_icons_zip(icons, cleanup.close),
+                                        f'{archive_name}.zip', 'application/zip')
+            resp.call_on_close(cleanup.close)
+            return resp
+
+        icon_paths = generate_app_icons(source, platforms)
 
         if not icon_paths:
             flash("Failed to generate icon set.")
             return redirect(url_for('index'))
 
-        zip_path = zip_files(icon_paths, 'ios_app_icons.zip')
+        # Unique archive name so concurrent requests don't overwrite each other.
+        zip_path = zip_files(icon_paths, unique_filename(archive_name, 'zip'))
         if zip_path:
-            return render_template('icon_set_generated.html', zip_path=os.path.basename(zip_path))
+            # The mockup previews the 60pt @3x home screen icon when the set has one.
+            mockup_icon = next((p for p in icon_paths if p.endswith(MOCKUP_ICON_NAME)), icon_paths[0])
+            return render_template('icon_set_generated.html', zip_path=os.path.basename(zip_path),
+                                   mockup_icon=output_name(mockup_icon))
         else:
             flash("Error creating zip file.")
             return redirect(url_for('index'))
@@ -342,9 +2057,9 @@ def generate_icon_set():
 
 @app.route('/xcode/download_assets/<filename>')
 def download_assets(filename):
-    assets_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-    if os.path.exists(assets_path):
-        return send_no_cache_file(assets_path, as_attachment=True)
+    assets_path = resolve_output(filename)
+    if assets_path:
+        return send_output_file(assets_path, as_attachment=True)
     else:
         flash("The requested asset file does not exist.")
         return redirect(url_for('index'))
@@ -366,31 +2081,29 @@ def filters():
 
         filename = secure_filename(file.filename)
         if filename:
-            input_filename = unique_filename('uploaded')
-            input_image_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-            file.save(input_image_path)
-
-            # Apply each filter in sequence
-            current_path = input_image_path
-            for f_type in filters_to_apply:
-                filtered_path = apply_filter_to_image(current_path, f_type)
-                if filtered_path is None:
-                    flash(f"Error applying filter '{f_type}'. Please try another image or filter.")
-                    return redirect(url_for('index'))
-                current_path = filtered_path
+            source = upload_source(file)
+            if wants_job():
+                return submit_job_response('filters', source, filters_to_apply)
+
+            # Apply the whole chain to a single decoded image, encoded for download
+            profile = download_profile()
+            current_path = apply_filter_pipeline(source, filters_to_apply, profile)
+            if current_path is None:
+                flash(f"Error applying filters '{filter_pipeline}'. Please try another image or filter.")
+                return redirect(url_for('index'))
 
             # Return the final filtered image as a download
-            return send_no_cache_file(current_path, as_attachment=True, mimetype='image/png')
+            return send_download(current_path, stored_profile=profile)
         else:
             flash("Invalid filename.")
             return redirect(url_for('index'))
     else:
         return redirect(url_for('index'))
 
-@app.route('/xcode/homescreen_mockup/<filename>')
+@app.route('/xcode/homescreen_mockup/<path:filename>')
 def homescreen_mockup(filename):
-    output_image_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-    if not os.path.exists(output_image_path):
+    output_image_path = resolve_output(filename)
+    if output_image_path is None:
         flash("The requested file does not exist.")
         return redirect(url_for('index'))
 
@@ -406,13 +2119,24 @@ def frame_screenshot():
     if 'file' not in request.files:
         flash("No file selected.")
         return redirect(url_for('index'))
+    # Several 'file' uploads are framed side by side on one canvas.
+    files = [f for f in request.files.getlist('file') if secure_filename(f.filename)]
+    if len(files) > 1:
+        if wants_job():
+            flash("Background jobs frame one screenshot at a time.")
+            return redirect(url_for('index'))
+        framed_path = overlay_frames([upload_source(f) for f in files])
+        if framed_path:
+            return render_template('frame_preview.html', frame_filename=os.path.basename(framed_path))
+        flash("Error creating framed screenshots.")
+        return redirect(url_for('index'))
     file = request.files['file']
     filename = secure_filename(file.filename)
     if filename:
-        input_filename = unique_filename('uploaded')
-        input_image_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-        file.save(input_image_path)
-        framed_path = overlay_frame(input_image_path)
+        source = upload_source(file)
+        if wants_job():
+            return submit_job_response('frame', source)
+        framed_path = overlay_frame(source)
         if framed_path:
             return render_template('frame_preview.html', frame_filename=os.path.basename(framed_path))
         else:
@@ -430,12 +2154,11 @@ def convert_profile():
     file = request.files['file']
     filename = secure_filename(file.filename)
     if filename:
-        input_filename = unique_filename('uploaded')
-        input_image_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-        file.save(input_image_path)
-        srgb_path = convert_color_profile(input_image_path)
+        source = upload_source(file)
+        profile = download_profile()
+        srgb_path = convert_color_profile(source, profile)
         if srgb_path:
-            return send_no_cache_file(srgb_path, as_attachment=True, mimetype='image/png')
+            return send_download(srgb_path, stored_profile=profile)
         else:
             flash("Error converting color profile.")
             return redirect(url_for('index'))
@@ -451,10 +2174,10 @@ def create_launch_screen():
     file = request.files['file']
     filename = secure_filename(file.filename)
     if filename:
-        input_filename = unique_filename('uploaded')
-        input_image_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-        file.save(input_image_path)
-        launch_path = generate_launch_screen(input_image_path)
+        source = upload_source(file)
+        if wants_job():
+            return submit_job_response('launch_screen', source)
+        launch_path = generate_launch_screen(source)
         if launch_path:
             return render_template('launch_screen_generated.html', launch_filename=os.path.basename(launch_path))
         else:
@@ -478,6 +2201,191 @@ def typography_preview():
     else:
         return redirect(url_for('index'))
 
+@app.route('/xcode/batch', methods=['POST'])
+def batch():
+    try:
+        op, args = parse_batch_operation(request.form)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    uploads = [(file.filename, detach_upload(file)) for file in request.files.getlist('files') if file.filename]
+    archive = request.files.get('archive')
+    archive = detach_upload(archive) if archive and archive.filename else None
+    if not uploads and archive is None:
+        return jsonify(error="No files uploaded. Send 'files' uploads or an 'archive' ZIP."), 400
+    if job_queue.pending() >= job_queue.max_pending:
+        close_batch_sources(uploads, archive)
+        return queue_full_response()
+    errors = []
+    chunks = stream_batch_zip(op, args, iter_batch_sources(uploads, archive, errors), errors)
+    resp = send_no_cache_stream(chunks, f'batch_{op}.zip', 'application/zip')
+    # A response closed before its first chunk never runs the generators' cleanup.
+    resp.call_on_close(lambda: close_batch_sources(uploads, archive))
+    return resp
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target for this worker process."""
+    return Response(metrics.render(metrics_samples()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/xcode/jobs/<job_id>')
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify(error="Unknown job."), 404
+    body = {'job_id': job_id, 'status': status}
+    if status == 'done':
+        body['result_url'] = url_for('job_result', job_id=job_id)
+    return jsonify(body)
+
+@app.route('/xcode/jobs/<job_id>/result')
+def job_result(job_id):
+    output_path = job_queue.output_path(job_id)
+    if output_path is None or not os.path.exists(output_path):
+        return jsonify(error="Job result is not available."), 404
+    if output_path.endswith('.zip'):
+        return send_output_file(output_path, as_attachment=True)
+    return send_download(output_path)
+
+class AsgiAdapter:
+    """
+    Serves the Flask app over ASGI. Request bodies are received and response
+    bodies sent on the event loop, so slow clients cost no thread; the app
+    itself (routing, decoding, Pillow work) and every step of response
+    iteration run on a bounded thread pool. Bodies are spooled to memory or
+    UPLOAD_FOLDER before the app sees them.
+    """
+    def __init__(self, wsgi_app, max_workers):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type '{scope['type']}'.")
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def receive_body(self, receive):
+        """Spool the request body; returns (stream, length), or None if the client left."""
+        body = tempfile.SpooledTemporaryFile(max_size=app.config['UPLOAD_SPOOL_MAX_BYTES'],
+                                             dir=app.config['UPLOAD_FOLDER'])
+        length = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            body.write(chunk)
+            length += len(chunk)
+            if not message.get('more_body', False):
+                body.seek(0)
+                return body, length
+
+    def environ(self, scope, body, length):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+            'PATH_INFO': scope['path'].encode().decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            # Larger reads than werkzeug's default, so file sends take fewer pool hops.
+            'wsgi.file_wrapper': lambda f, buffer_size=8192: FileWrapper(
+                f, max(buffer_size, app.config['ASYNC_FILE_CHUNK_BYTES'])),
+        }
+        for name, value in scope.get('headers', []):
+            key = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        if 'CONTENT_LENGTH' not in environ and length:
+            environ['CONTENT_LENGTH'] = str(length)
+        return environ
+
+    async def http(self, scope, receive, send):
+        received = await self.receive_body(receive)
+        if received is None:
+            return
+        body, length = received
+        loop = asyncio.get_running_loop()
+        started = {}
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return lambda data: started.setdefault('written', []).append(data)
+
+        def next_chunk(iterator):
+            # WSGI iterables may yield empty chunks; skip them off the loop.
+            for chunk in iterator:
+                if chunk:
+                    return chunk
+            return None
+
+        watcher = loop.create_task(watch_disconnect())
+        try:
+            result = await loop.run_in_executor(self.executor, self.wsgi_app,
+                                                self.environ(scope, body, length), start_response)
+            try:
+                iterator = iter(result)
+                first = await loop.run_in_executor(self.executor, next_chunk, iterator)
+                await send({'type': 'http.response.start', 'status': started['status'],
+                            'headers': started['headers']})
+                for chunk in started.get('written', []):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = first
+                while chunk is not None and not disconnected.is_set():
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                    chunk = await loop.run_in_executor(self.executor, next_chunk, iterator)
+                if not disconnected.is_set():
+                    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            finally:
+                # Closing runs generator cleanup, e.g. releasing a streamed ZIP's memory budget.
+                if hasattr(result, 'close'):
+                    await loop.run_in_executor(self.executor, result.close)
+        finally:
+            watcher.cancel()
+            body.close()
+
+asgi_app = AsgiAdapter(app, app.config['ASYNC_WORKERS'])
+
 if __name__ == '__main__':
-    # In production, run with a proper WSGI server.
-    app.run(host='0.0.0.0', port=699, debug=False)
\ No newline at end of file
+    # In production, run with a proper WSGI server, or SERVER_MODE=asgi to serve
+    # asgi_app with uvicorn (pip install uvicorn).
+    if os.environ.get('SERVER_MODE', 'wsgi') == 'asgi':
+        if uvicorn is None:
+            sys.exit("SERVER_MODE=asgi requires uvicorn (pip install uvicorn).")
+        uvicorn.run(asgi_app, host='0.0.0.0', port=699, log_level='info')
+    else:
+        app.run(host='0.0.0.0', port=699, debug=False)
\ No newline at end of file
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for ero-xcode.py.
+
+  python xcode_bench.py micro [--sizes 512,2048] [--modes RGB,P] [--repeat 5]
+  python xcode_bench.py load [--route filters] [--concurrency 8] [--requests 200] [--url http://127.0.0.1:699]
+
+micro times each transform function directly on synthetic images. load drives
+a route through the Flask test client, or a running server when --url is
+given; with --async each request is timed from submission until its job's
+result has been downloaded. Both print JSON (or write it to --output) so runs
+can be diffed.
+"""
+import argparse
+import importlib.util
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, features
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SIZES = [512, 1024, 2048]
+# 'I;16' is 16-bit grayscale, 'P' an adaptive 256-colour palette.
+DEFAULT_MODES = ['RGB', 'RGBA', 'P', 'I;16']
+
+def load_xcode():
+    """Import ero-xcode.py (not importable by name) with its janitor disabled."""
+    os.environ.setdefault('JANITOR_ENABLED', '0')
+    spec = importlib.util.spec_from_file_location('ero_xcode', os.path.join(BASE_DIR, 'ero-xcode.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def isolate(xcode, workdir):
+    """
+    Point the app's output and upload folders at workdir, and substitute
+    synthetic templates for any missing static assets so every transform runs.
+    """
+    for key in ('OUTPUT_FOLDER', 'UPLOAD_FOLDER'):
+        xcode.app.config[key] = os.path.join(workdir, key.lower())
+        os.makedirs(xcode.app.config[key], exist_ok=True)
+    for attr, size in (('MOCKUP_PATH', (1170, 2532)), ('FRAME_PATH', (1000, 1900)),
+                       ('LAUNCH_BACKGROUND_PATH', (1242, 2688))):
+        if not os.path.exists(getattr(xcode, attr)):
+            path = os.path.join(workdir, f"{attr.lower()}.png")
+            synthetic_image(size, 'RGBA').save(path)
+            setattr(xcode, attr, path)
+
+def synthetic_image(size, mode):
+    """
+    Deterministic test image: gradients plus noise, so PNG and JPEG encoders
+    see realistic rather than trivially compressible content.
+    """
+    noise = Image.effect_noise(size, 48)
+    bands = [Image.linear_gradient('L').resize(size), noise,
+             Image.radial_gradient('L').resize(size), Image.linear_gradient('L').rotate(90).resize(size)]
+    if mode == 'RGB':
+        return Image.merge('RGB', bands[:3])
+    if mode == 'RGBA':
+        return Image.merge('RGBA', bands)
+    if mode == 'P':
+        return Image.merge('RGB', bands[:3]).quantize(256)
+    if mode == 'I;16':
+        return Image.merge('RGB', bands[:3]).convert('L').convert('I').point(lambda v: v * 257).convert('I;16')
+    if mode == 'L':
+        return Image.merge('RGB', bands[:3]).convert('L')
+    raise ValueError(f"Unsupported mode '{mode}'.")
+
+def synthetic_upload(size, mode, fmt='PNG'):
+    buf = io.BytesIO()
+    synthetic_image((size, size), mode).save(buf, format=fmt)
+    return buf.getvalue()
+
+def unique_upload(data):
+    """
+    Make upload bytes distinct without re-encoding, so the result cache misses.
+    Decoders stop at the end-of-image marker and ignore the trailing tag.
+    """
+    return data + b'bench' + uuid.uuid4().bytes
+
+def percentiles(samples):
+    """Nearest-rank p50/p95/p99 plus min, max and mean, in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+    return {
+        'min_ms': ordered[0] * 1000,
+        'p50_ms': rank(50) * 1000,
+        'p95_ms': rank(95) * 1000,
+        'p99_ms': rank(99) * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'mean_ms': statistics.fmean(ordered) * 1000,
+    }
+
+def micro_transforms(xcode):
+    """
+    Transform name -> callable(source). Cached transforms run without the
+    result cache so it never short-circuits a timed run, while the memory
+    budget stays in place as it would in production.
+    """
+    def bare(fn):
+        return getattr(fn, 'uncached', fn)
+
+    return {
+        'icon_set': lambda src: bare(xcode.generate_app_icons)(src, ('ios',)),
+        'icon_set_all': lambda src: bare(xcode.generate_app_icons)(src, xcode.ICON_PLATFORMS),
+        'filter_blur': lambda src: bare(xcode.apply_filter_pipeline)(src, ['blur']),
+        'filter_sharpen': lambda src: bare(xcode.apply_filter_pipeline)(src, ['sharpen']),
+        'filter_chain': lambda src: bare(xcode.apply_filter_pipeline)(
+            src, ['brightness_up', 'contrast_up', 'color_up', 'invert']),
+        'convert': lambda src: bare(xcode.convert_image)(src, (1024, 1024)),
+        'frame': lambda src: xcode.overlay_frame(src),
+        'srgb': lambda src: bare(xcode.convert_color_profile)(src),
+        'launch_screen': lambda src: xcode.generate_launch_screen(src),
+    }
+
+def run_micro(args):
+    xcode = load_xcode()
+    workdir = tempfile.mkdtemp(prefix='xcode_bench_')
+    results = []
+    try:
+        isolate(xcode, workdir)
+        transforms = micro_transforms(xcode)
+        names = args.transforms or list(transforms)
+        for mode in args.modes:
+            for size in args.sizes:
+                data = synthetic_upload(size, mode)
+                for name in names:
+                    timings, errors = [], 0
+                    for i in range(args.warmup + args.repeat):
+                        start = time.perf_counter()
+                        try:
+                            ok = bool(transforms[name](io.BytesIO(data)))
+                        except Exception as e:
+                            print(f"{name} {mode} {size}px failed: {e}", file=sys.stderr)
+                            ok = False
+                        elapsed = time.perf_counter() - start
+                        if not ok:
+                            errors += 1
+                        elif i >= args.warmup:
+                            timings.append(elapsed)
+                    results.append({'transform': name, 'mode': mode, 'size': size, 'input_bytes': len(data),
+                                    'runs': len(timings), 'errors': errors, **percentiles(timings)})
+                    print(f"{name:>14} {mode:>5} {size:>5}px  "
+                          f"p50 {results[-1].get('p50_ms', float('nan')):8.1f} ms", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'benchmark': 'micro', 'repeat': args.repeat, 'warmup': args.warmup, 'results': results}
+
+# Route name -> (path, extra form fields).
+LOAD_ROUTES = {
+    'filters': ('/xcode/filters', {'filter_pipeline': 'blur,contrast_up'}),
+    'icon_set': ('/xcode/generate_icon_set', {}),
+    'icon_set_stream': ('/xcode/generate_icon_set', {'stream': '1'}),
+    'icon_set_all': ('/xcode/generate_icon_set', {'stream': '1', 'platforms': 'ios,android,macos,watchos'}),
+    'convert': ('/xcode/convert', {}),
+    'frame': ('/xcode/frame_screenshot', {}),
+    'srgb': ('/xcode/convert_color_profile', {}),
+    'launch_screen': ('/xcode/generate_launch_screen', {}),
+}
+
+def multipart_body(fields, file_bytes, filename='bench.png'):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+    parts.append(file_bytes)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+def http_sender(url):
+    """
+    Return send(path, fields, data) -> (status, response_body, location)
+    against a running server. With data None it sends a GET instead of the
+    upload. Redirects are reported, not followed.
+    """
+    opener = urllib.request.build_opener(NoRedirect)
+
+    def send(path, fields=None, data=None):
+        if data is None:
+            req = urllib.request.Request(url.rstrip('/') + path)
+        else:
+            body, content_type = multipart_body(fields, data)
+            req = urllib.request.Request(url.rstrip('/') + path, data=body, method='POST',
+                                         headers={'Content-Type': content_type})
+        try:
+            with opener.open(req) as resp:
+                return resp.status, resp.read(), resp.headers.get('Location', '')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers.get('Location', '')
+    return send
+
+def test_client_sender(xcode):
+    """send() for the in-process app, with one test client per load thread."""
+    local = threading.local()
+
+    def send(path, fields=None, data=None):
+        if not hasattr(local, 'client'):
+            local.client = xcode.app.test_client()
+        if data is None:
+            resp = local.client.get(path)
+        else:
+            resp = local.client.post(path, data={**fields, 'file': (io.BytesIO(data), 'bench.png')})
+        try:
+            return resp.status_code, resp.get_data(), resp.headers.get('Location', '')
+        finally:
+            resp.close()
+    return send
+
+def await_job(send, submitted, poll_interval, timeout):
+    """
+    Poll the status_url of a 202 job submission until the job finishes, then
+    download its result. Returns (status, response_body, location) of the
+    download, or ('job_failed' | 'job_timeout', b'', '') when there is none.
+    """
+    job = json.loads(submitted)
+    deadline = time.monotonic() + timeout
+    while True:
+        status, body, _ = send(job['status_url'])
+        state = json.loads(body).get('status') if status == 200 else 'failed'
+        if state == 'done':
+            return send(json.loads(body)['result_url'])
+        if state == 'failed':
+            return 'job_failed', b'', ''
+        if time.monotonic() >= deadline:
+            return 'job_timeout', b'', ''
+        time.sleep(poll_interval)
+
+def succeeded(status, location):
+    """2xx, or a redirect to a result page; the app reports failures by redirecting to /xcode/."""
+    if not isinstance(status, int):
+        return False
+    if 200 <= status < 300:
+        return True
+    return 300 <= status < 400 and not location.split('?')[0].rstrip('/').endswith('/xcode')
+
+def run_load(args):
+    workdir = None
+    if args.url:
+        send = http_sender(args.url)
+    else:
+        xcode = load_xcode()
+        workdir = tempfile.mkdtemp(prefix='xcode_bench_')
+        isolate(xcode, workdir)
+        send = test_client_sender(xcode)
+
+    path, fields = LOAD_ROUTES[args.route]
+    if args.async_jobs:
+        fields = {**fields, 'async': '1'}
+    data = synthetic_upload(args.size, args.mode)
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+    bytes_out = 0
+
+    def one(_):
+        nonlocal bytes_out
+        payload = data if args.cached else unique_upload(data)
+        start = time.perf_counter()
+        try:
+            status, body, location = send(path, fields, payload)
+            # A job is only finished once its result can be downloaded; time all of it.
+            if args.async_jobs and status == 202:
+                status, body, location = await_job(send, body, args.poll_interval, args.job_timeout)
+            ok = succeeded(status, location)
+            size = len(body)
+        except Exception as e:
+            print(f"request failed: {e}", file=sys.stderr)
+            status, size, ok = 'exception', 0, False
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if ok:
+                latencies.append(elapsed)
+                bytes_out += size
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            # Every warmup request (and job) has finished before the measured run starts.
+            list(pool.map(one, range(args.warmup)))
+            latencies.clear()
+            statuses.clear()
+            bytes_out = 0
+            start = time.perf_counter()
+            list(pool.map(one, range(args.requests)))
+            wall = time.perf_counter() - start
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'benchmark': 'load',
+        'target': args.url or 'test_client',
+        'route': args.route,
+        'path': path,
+        'mode': args.mode,
+        'size': args.size,
+        'input_bytes': len(data),
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'cached_input': args.cached,
+        'async_jobs': args.async_jobs,
+        'statuses': statuses,
+        'ok': len(latencies),
+        'errors': args.requests - len(latencies),
+        'wall_seconds': wall,
+        'throughput_rps': len(latencies) / wall if wall else None,
+        'response_bytes': bytes_out,
+        **percentiles(latencies),
+    }
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pillow': Image.__version__,
+        'libimagequant': features.check('libimagequant'),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+def csv_list(cast):
+    return lambda text: [cast(v) for v in text.split(',') if v]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the ero-xcode image service.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--output', help="Write the JSON report here instead of stdout.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    micro = sub.add_parser('micro', parents=[common], help="Time each transform function on synthetic images.")
+    micro.add_argument('--sizes', type=csv_list(int), default=DEFAULT_SIZES)
+    micro.add_argument('--modes', type=csv_list(str), default=DEFAULT_MODES)
+    micro.add_argument('--transforms', type=csv_list(str), default=None,
+                       help="Comma-separated subset of: icon_set, icon_set_all, filter_blur, filter_sharpen, "
+                            "filter_chain, convert, frame, srgb, launch_screen.")
+    micro.add_argument('--repeat', type=int, default=5)
+    micro.add_argument('--warmup', type=int, default=1)
+
+    load = sub.add_parser('load', parents=[common], help="Drive one route at a fixed concurrency.")
+    load.add_argument('--route', choices=sorted(LOAD_ROUTES), default='filters')
+    load.add_argument('--url', help="Base URL of a running server; default is the in-process test client.")
+    load.add_argument('--concurrency', type=int, default=4)
+    load.add_argument('--requests', type=int, default=100)
+    load.add_argument('--warmup', type=int, default=4)
+    load.add_argument('--size', type=int, default=1024)
+    load.add_argument('--mode', default='RGB')
+    load.add_argument('--cached', action='store_true', help="Send identical bytes so repeats hit the result cache.")
+    load.add_argument('--async', dest='async_jobs', action='store_true',
+                      help="Submit as background jobs (async=1) and wait for each result.")
+    load.add_argument('--poll-interval', type=float, default=0.05, help="Seconds between job status polls.")
+    load.add_argument('--job-timeout', type=float, default=300, help="Give up waiting on a job after this long.")
+
+    args = parser.parse_args()
+    report = run_micro(args) if args.command == 'micro' else run_load(args)
+    report['environment'] = environment()
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)